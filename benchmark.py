@@ -0,0 +1,576 @@
+#!/usr/bin/python
+"Benchmarks for pyqscore on synthetic OpenArena logs."
+
+#   pyqscore. Parse OpenArena/Quake3 logs and write statistics to HTML.
+#   Copyright (C) 2011  Jose Rodriguez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Usage:
+#
+#   python benchmark.py memory       peak memory vs log size, up to the store
+#   python benchmark.py scaling      parsing time vs number of processes
+#   python benchmark.py rebuild      reparsing vs adding up the game archive
+#   python benchmark.py games        memory taken by parsed games
+#   python benchmark.py items        parsing time with and without items
+#   python benchmark.py render       time to write a big HTML report
+#   python benchmark.py leaderboards top players by many keys, heaps vs sorts
+#   python benchmark.py verify       the faster ways give the same stats
+#
+# Every measurement runs in a fresh child process, so peak memory figures
+# (ru_maxrss) are not polluted by previous runs.
+
+import sys
+import os
+import time
+import gzip
+import shutil
+import random
+import resource
+import subprocess
+import tempfile
+import multiprocessing
+
+import pyqscore
+
+
+MODS = ['UNKNOWN', 'SHOTGUN', 'GAUNTLET', 'MACHINEGUN', 'GRENADE',
+        'GRENADE_SPLASH', 'ROCKET', 'ROCKET_SPLASH', 'PLASMA', 'PLASMA_SPLASH',
+        'RAILGUN', 'LIGHTNING', 'BFG', 'BFG_SPLASH', 'WATER', 'SLIME', 'LAVA',
+        'CRUSH', 'TELEFRAG', 'FALLING', 'SUICIDE', 'TARGET_LASER',
+        'TRIGGER_HURT', 'NAIL', 'CHAINGUN']
+WEAPON_MODS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 18, 23, 24]
+ITEMS = ['item_armor_combat', 'item_health_mega', 'item_quad', 'item_regen',
+         'item_haste', 'item_health', 'item_armor_shard', 'ammo_rockets',
+         'weapon_rocketlauncher', 'ammo_cells']
+AWARDS = ['IMPRESSIVE', 'EXCELLENT', 'GAUNTLET', 'DEFENCE', 'CAPTURE', 'ASSIST']
+
+
+def ts(seconds):
+    '''Log time stamp, as written by the game'''
+    return '%3i:%02i ' % (seconds // 60, seconds % 60)
+
+
+def write_game(f, r, names, players):
+    '''Write one complete random game to file f'''
+    gtype = r.choice([0, 4])
+    f.write(ts(0) + '-' * 60 + '\n')
+    f.write(ts(0) + 'InitGame: \\sv_hostname\\^1Bench\\g_gametype\\%d'
+            '\\mapname\\%s\\sv_maxclients\\16\n' %
+            (gtype, r.choice(['oasago2', 'aggressor', 'ctf_gate1'])))
+    ps = r.sample(names, players)
+    for cid, nick in enumerate(ps):
+        join = 0 if r.random() < 0.8 else r.randint(0, 300)
+        team = cid % 2 + 1 if gtype == 4 else 0
+        f.write(ts(join) + 'ClientConnect: %d\n' % cid)
+        f.write(ts(join) + 'ClientUserinfoChanged: %d n\\%s\\t\\%d\\model'
+                '\\sarge\\hmodel\\sarge\\c1\\4\\c2\\5\\hc\\100\\w\\0\\l\\0'
+                '\\tt\\0\\tl\\0\n' % (cid, nick, team))
+        f.write(ts(join) + 'ClientBegin: %d\n' % cid)
+    end = r.randint(400, 900)
+    for t in xrange(1, end):
+        for _ in xrange(r.randint(0, 2)):
+            a, b = r.randrange(players), r.randrange(players)
+            x = r.random()
+            if x < 0.6:
+                f.write(ts(t) + 'Item: %d %s\n' % (a, r.choice(ITEMS)))
+            elif x < 0.9:
+                mod = r.choice(WEAPON_MODS)
+                if x > 0.88:
+                    a, mod = 1022, 19
+                killer = '<world>' if a == 1022 else ps[a]
+                f.write(ts(t) + 'Kill: %d %d %d: %s killed %s by MOD_%s\n' %
+                        (a, b, mod, killer, ps[b], MODS[mod]))
+            elif x < 0.93:
+                f.write(ts(t) + 'Award: %d 1: %s gained the %s award!\n' %
+                        (a, ps[a], r.choice(AWARDS)))
+            elif x < 0.96 and gtype == 4:
+                f.write(ts(t) + 'CTF: %d %d %d: %s got the flag!\n' %
+                        (a, a % 2 + 1, r.randint(0, 3), ps[a]))
+            elif x < 0.97:
+                f.write(ts(t) + 'say: %s: quote %d\n' % (ps[a], r.randint(0, 99)))
+    f.write(ts(end) + 'Exit: Timelimit hit.\n')
+    if gtype == 4:
+        f.write(ts(end) + 'red:%d  blue:%d\n' % (r.randint(0, 8), r.randint(0, 8)))
+    for cid in r.sample(range(players), players):
+        f.write(ts(end) + 'score: %d  ping: %d  client: %d %s\n' %
+                (r.randint(0, 30), r.randint(20, 150), cid, ps[cid]))
+    f.write(ts(end) + 'ShutdownGame:\n')
+
+
+def make_log(path, games, players=8, pool=50, seed=1):
+    '''Write a synthetic log with the given number of games'''
+    r = random.Random(seed)
+    names = ['^%dPlayer%d' % (i % 8, i) for i in xrange(pool)]
+    with open(path, 'w') as f:
+        for _ in xrange(games):
+            write_game(f, r, names, players)
+    return path
+
+
+def child(stage, log_file):
+    '''Run one stage on log_file and print seconds and peak KiB'''
+    start = time.time()
+    if stage == 'read':
+        for line in pyqscore.LogReader(log_file):
+            pass
+    elif stage == 'parse':
+        pyqscore.mainProcessing(pyqscore.LogReader(log_file))
+    elif stage == 'store':
+        # What a run does: parse, then write the games to a new store
+        store_file = os.path.splitext(log_file)[0] + '_stats.db'
+        db = pyqscore.open_store(store_file)
+        quietly(pyqscore.process_logs, db, [log_file])
+        db.close()
+        os.remove(store_file)
+        os.remove(os.path.splitext(log_file)[0] + '_stats.games')
+    elif stage == 'parse-noitems':
+        # Item lines skipped, as they were before items were counted
+        del pyqscore.EVENT_HANDLERS['Item']
+        pyqscore.mainProcessing(pyqscore.LogReader(log_file))
+    elif stage.startswith('parallel'):
+        pyqscore.parallelProcessing(log_file, 0, int(stage[8:]))[3].close()
+    elif stage == 'games':
+        # Keep every game alive, as older versions did until the end
+        games = list(pyqscore.iter_games(pyqscore.LogReader(log_file),
+                                         pyqscore.Server()))
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print elapsed, peak
+
+
+def quietly(function, *args):
+    '''function(*args), without what it prints'''
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        return function(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def measure(stage, log_file):
+    '''Run child() in a fresh interpreter, returns (seconds, peak KiB)'''
+    out = subprocess.check_output([sys.executable, __file__, 'child',
+                                   stage, log_file])
+    elapsed, peak = out.split()
+    return float(elapsed), int(peak)
+
+
+def bench_memory():
+    '''Peak memory of reading, parsing and storing logs of growing size. 
+    The store stage is what a run does, game records and all. Peaks are 
+    those of the main process, where the records end up.'''
+    tmp_dir = tempfile.mkdtemp()
+    print '%8s %10s %8s %12s %12s' % ('games', 'MiB', 'stage', 'seconds',
+                                      'peak KiB')
+    for games in (100, 400, 1600, 3200):
+        log_file = make_log(os.path.join(tmp_dir, 'games.log'), games)
+        size = os.path.getsize(log_file) / 2.**20
+        for stage in ('read', 'parse', 'store'):
+            elapsed, peak = measure(stage, log_file)
+            print '%8d %10.1f %8s %12.2f %12d' % (games, size, stage, elapsed,
+                                                  peak)
+        os.remove(log_file)
+    os.rmdir(tmp_dir)
+
+
+def bench_scaling():
+    '''Time to parse a big log with a growing number of processes'''
+    tmp_dir = tempfile.mkdtemp()
+    log_file = make_log(os.path.join(tmp_dir, 'games.log'), 3200)
+    print '%.1f MiB log, %d CPU cores' % (os.path.getsize(log_file) / 2.**20,
+                                          multiprocessing.cpu_count())
+    print '%10s %12s %12s' % ('processes', 'seconds', 'speedup')
+    serial = measure('parse', log_file)[0]
+    print '%10s %12.2f %12.2f' % ('serial', serial, 1)
+    processes = 1
+    while processes <= max(2, multiprocessing.cpu_count()):
+        elapsed = measure('parallel%d' % processes, log_file)[0]
+        print '%10d %12.2f %12.2f' % (processes, elapsed, serial / elapsed)
+        processes *= 2
+    os.remove(log_file)
+    os.rmdir(tmp_dir)
+
+
+def bench_games():
+    '''Memory taken by parsed games, kept in memory, with many players'''
+    tmp_dir = tempfile.mkdtemp()
+    print '%8s %8s %12s %12s' % ('games', 'players', 'KiB/game', 
+                                 'KiB/player')
+    for players in (8, 32):
+        games = 800
+        log_file = make_log(os.path.join(tmp_dir, 'games.log'), games,
+                            players=players, pool=4 * players)
+        base = measure('read', log_file)[1]
+        peak = measure('games', log_file)[1]
+        per_game = float(peak - base) / games
+        print '%8d %8d %12.2f %12.3f' % (games, players, per_game, 
+                                         per_game / players)
+        os.remove(log_file)
+    os.rmdir(tmp_dir)
+
+
+def bench_items():
+    '''Throughput of parsing with item pickups counted, against skipping
+    Item lines. Runs take turns, and the best of five is kept.'''
+    tmp_dir = tempfile.mkdtemp()
+    log_file = make_log(os.path.join(tmp_dir, 'games.log'), 1600)
+    size = os.path.getsize(log_file) / 2.**20
+    print '%.1f MiB log' % size
+    print '%14s %12s %12s' % ('', 'seconds', 'MiB/s')
+    stages = ('parse-noitems', 'parse')
+    times = dict((stage, []) for stage in stages)
+    for _ in xrange(5):
+        for stage in stages:
+            times[stage].append(measure(stage, log_file)[0])
+    times = dict((stage, min(times[stage])) for stage in stages)
+    for stage in stages:
+        print '%14s %12.2f %12.2f' % (stage, times[stage], 
+                                      size / times[stage])
+    print 'Counting items costs %.1f%%' % (100. * times['parse'] / 
+                                          times['parse-noitems'] - 100)
+    os.remove(log_file)
+    os.rmdir(tmp_dir)
+
+
+def random_players(n, seed=1):
+    '''n players with random totals, as read_store() returns them'''
+    r = random.Random(seed)
+    players = {}
+    for i in xrange(n):
+        name = '^%dPlayer%d' % (i % 8, i)
+        sums = [r.randint(1, 500) for column in pyqscore.ADD_COLUMNS]
+        players[name] = pyqscore.PlayerTotals(name, sums, r.randint(20, 60),
+                                              r.randint(60, 200))
+    return players
+
+
+def bench_render():
+    '''Time to write the HTML report of many players, best of five. Then
+    again with the fragment cache of the same report, when nothing changed
+    and the file isn't written.'''
+    tmp_dir = tempfile.mkdtemp()
+    pyqscore.MOVE_HTML_OUTPUT = False
+    report = os.path.join(tmp_dir, 'games')
+    server = pyqscore.Server()
+    server.hostname = '^1Bench'
+    quotes = [('^1Player1', 'quote %d' % i) for i in xrange(100)]
+    print '%10s %12s %14s %12s' % ('players', 'ms', 'unchanged ms', 'KiB')
+    for n in (150, 1000, 10000):
+        pyqscore.MAXPLAYERS = n
+        R = pyqscore.player_list(random_players(n))
+        times = []
+        for _ in xrange(5):
+            start = time.time()
+            html_file = pyqscore.write_html(R, server, quotes, report)
+            times.append(time.time() - start)
+        fragments = {}
+        pyqscore.write_html(R, server, quotes, report, fragments)
+        cached = []
+        for _ in xrange(5):
+            start = time.time()
+            pyqscore.write_html(R, server, quotes, report, fragments)
+            cached.append(time.time() - start)
+        print '%10d %12.1f %14.1f %12d' % (n, 1000 * min(times), 
+                                           1000 * min(cached),
+                                           os.path.getsize(html_file) // 1024)
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    os.rmdir(tmp_dir)
+
+
+def bench_leaderboards():
+    '''Time to pick the top MAXPLAYERS of every sort option in one go, 
+    against sorting all the players once per option, best of five'''
+    options = sorted(pyqscore.RANKINGS)
+    print '%d options, top %d' % (len(options), pyqscore.MAXPLAYERS)
+    print '%10s %12s %16s' % ('players', 'sorts ms', 'leaderboards ms')
+    for n in (1000, 10000, 100000):
+        R = pyqscore.player_list(random_players(n))
+        sorts, heaps = [], []
+        for _ in xrange(5):
+            start = time.time()
+            for option in options:
+                key, highest = pyqscore.RANKINGS[option]
+                sorted(R, key=key, reverse=highest)[:pyqscore.MAXPLAYERS]
+            sorts.append(time.time() - start)
+            start = time.time()
+            pyqscore.leaderboards(R, options, pyqscore.MAXPLAYERS)
+            heaps.append(time.time() - start)
+        print '%10d %12.1f %16.1f' % (n, 1000 * min(sorts), 1000 * min(heaps))
+
+
+def bench_rebuild():
+    '''Time to add up the stats again from the game archive, as done when
+    MINPLAY changes, against parsing the log'''
+    tmp_dir = tempfile.mkdtemp()
+    log_file = make_log(os.path.join(tmp_dir, 'games.log'), 1600)
+    db = pyqscore.open_store(os.path.join(tmp_dir, 'games_stats.db'))
+    start = time.time()
+    pyqscore.process_logs(db, [log_file])
+    parse = time.time() - start
+    start = time.time()
+    pyqscore.rebuild_store(db)
+    rebuild = time.time() - start
+    archive_file = pyqscore.archive_path(db)
+    print '%10s %10s %12s' % ('', 'MiB', 'seconds')
+    print '%10s %10.1f %12.2f' % ('log', os.path.getsize(log_file) / 2.**20,
+                                  parse)
+    print '%10s %10.1f %12.2f' % ('archive', 
+                                  os.path.getsize(archive_file) / 2.**20,
+                                  rebuild)
+    db.close()
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    os.rmdir(tmp_dir)
+
+
+def store_summary(store_file, log_files):
+    '''Bring a stats store up to date with some logs, as a run does, and 
+    return what their output is made from, see pyqscore.ReportData. It 
+    compares equal for any two stores with the same games, whatever the
+    paths of the logs.'''
+    db = quietly(pyqscore.open_store, store_file)
+    quietly(pyqscore.process_logs, db, log_files)
+    data = pyqscore.ReportData(db, log_files, '')
+    db.close()
+
+    def rows(totals):
+        return sorted((name, player.row()) for name, player in 
+                      totals.iteritems())
+    server = pyqscore.combine_servers(data.servers)
+    groups = [(key, [group[:4] + (rows(group[4]),) for group in 
+                     data.breakdown(key)])
+              for key in ('mapname', 'gametype', 'periods')]
+    return (rows(data.players), groups, sorted(data.versus.items()),
+            sorted(data.nicks.items()), sorted(data.ratings.items()),
+            sorted(data.quotes), server.frags, server.time)
+
+
+def cut_log(log_file, path, cut):
+    '''Copy the first cut bytes of log_file to path. Returns the rest.'''
+    with open(log_file, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:cut])
+    return data[cut:]
+
+
+def bench_verify():
+    '''Check that the stats are the same however the games are read: in
+    one go, in two runs with the log cut anywhere, in parallel, added up 
+    again from the archive for another MINPLAY, or across log rotations.
+    Exits with an error if any check fails.'''
+    tmp_dir = tempfile.mkdtemp()
+    pyqscore.PARALLEL_MIN = 0
+    log_file = make_log(os.path.join(tmp_dir, 'source.log'), 60, seed=2)
+    with open(log_file, 'rb') as f:
+        data = f.read()
+    middle = len(data) // 2
+    kill = data.index('Kill:', middle) - 7
+    exit = data.index('\n', data.index('Exit:', middle)) + 1
+    shutdown = data.index('\n', data.index('ShutdownGame:', middle)) + 1
+    cuts = [('mid-game', kill), ('mid-line', kill + 20), 
+            ('after Exit', exit), ('after ShutdownGame', shutdown)]
+    count = [0]
+    failed = []
+
+    def check(name, result, expected):
+        print '%-36s %s' % (name, 'ok' if result == expected else 'FAILED')
+        if result != expected:
+            failed.append(name)
+
+    def new_dir():
+        count[0] += 1
+        path = os.path.join(tmp_dir, str(count[0]))
+        os.mkdir(path)
+        return path
+
+    # The reference: the whole log in one run, one process
+    pyqscore.PROCESSES = 1
+    reference = new_dir()
+    shutil.copy(log_file, os.path.join(reference, 'games.log'))
+    full = store_summary(os.path.join(reference, 'games_stats.db'),
+                         [os.path.join(reference, 'games.log')])
+
+    for name, cut in cuts:
+        path = new_dir()
+        game_log = os.path.join(path, 'games.log')
+        store_file = os.path.join(path, 'games_stats.db')
+        rest = cut_log(log_file, game_log, cut)
+        store_summary(store_file, [game_log])
+        with open(game_log, 'ab') as f:
+            f.write(rest)
+        check('incremental, cut ' + name, store_summary(store_file, 
+                                                         [game_log]), full)
+
+    pyqscore.PROCESSES = 4
+    path = new_dir()
+    shutil.copy(log_file, os.path.join(path, 'games.log'))
+    check('parallel', store_summary(os.path.join(path, 'games_stats.db'),
+                                    [os.path.join(path, 'games.log')]), full)
+
+    # Rotated logs: games.log is renamed, or compressed to a new file, 
+    # while the store holds its games. Logs are parsed in parallel too.
+    for compress in (False, True):
+        path = new_dir()
+        game_log = os.path.join(path, 'games.log')
+        store_file = os.path.join(path, 'games_stats.db')
+        rest = cut_log(log_file, game_log, shutdown)
+        store_summary(store_file, [game_log])
+        if compress:
+            old_log = game_log + '.1.gz'
+            with open(game_log, 'rb') as f:
+                with gzip.open(old_log, 'wb') as z:
+                    z.write(f.read())
+            os.remove(game_log)
+        else:
+            old_log = game_log + '.1'
+            os.rename(game_log, old_log)
+        os.utime(old_log, (time.time() - 3600,) * 2)
+        with open(game_log, 'wb') as f:
+            f.write(rest)
+        rotated = store_summary(store_file, [game_log, old_log])
+        fresh = new_dir()
+        for log in (old_log, game_log):
+            shutil.copy2(log, fresh)
+        check('rotated, ' + ('compressed' if compress else 'renamed'), 
+              rotated, store_summary(
+                  os.path.join(fresh, 'games_stats.db'), 
+                  [os.path.join(fresh, os.path.basename(log)) for log in 
+                   (game_log, old_log)]))
+
+    # Rotated twice with delaycompress: games.log -> games.log.1, then 
+    # games.log.1 -> games.log.2.gz and games.log -> games.log.1
+    path = new_dir()
+    game_log = os.path.join(path, 'games.log')
+    store_file = os.path.join(path, 'games_stats.db')
+    quarter = data.index('\n', data.index('ShutdownGame:', middle // 2)) + 1
+    rest = cut_log(log_file, game_log, quarter)
+    store_summary(store_file, [game_log])
+    os.rename(game_log, game_log + '.1')
+    with open(game_log, 'wb') as f:
+        f.write(rest[:shutdown - quarter])
+    store_summary(store_file, [game_log, game_log + '.1'])
+    with open(game_log + '.1', 'rb') as f:
+        with gzip.open(game_log + '.2.gz', 'wb') as z:
+            z.write(f.read())
+    os.remove(game_log + '.1')
+    os.rename(game_log, game_log + '.1')
+    with open(game_log, 'wb') as f:
+        f.write(rest[shutdown - quarter:])
+    logs = [game_log, game_log + '.1', game_log + '.2.gz']
+    for age, log in enumerate(logs):
+        os.utime(log, (time.time() - 3600 * age,) * 2)
+    rotated = store_summary(store_file, logs)
+    fresh = new_dir()
+    for log in logs:
+        shutil.copy2(log, fresh)
+    check('rotated twice, delaycompress', rotated, store_summary(
+              os.path.join(fresh, 'games_stats.db'), 
+              [os.path.join(fresh, os.path.basename(log)) for log in logs]))
+
+    # Rotated twice keeping one old log: games.log.1 is deleted the second
+    # time. Its games still count in the periods and ratings.
+    path = new_dir()
+    game_log = os.path.join(path, 'games.log')
+    store_file = os.path.join(path, 'games_stats.db')
+    rest = cut_log(log_file, game_log, quarter)
+    store_summary(store_file, [game_log])
+    os.rename(game_log, game_log + '.1')
+    with open(game_log, 'wb') as f:
+        f.write(rest[:shutdown - quarter])
+    store_summary(store_file, [game_log, game_log + '.1'])
+    os.remove(game_log + '.1')
+    os.rename(game_log, game_log + '.1')
+    with open(game_log, 'wb') as f:
+        f.write(rest[shutdown - quarter:])
+    rotated = store_summary(store_file, [game_log, game_log + '.1'])
+    check('rotated twice, old log deleted', (rotated[1][2], rotated[4]), 
+          (full[1][2], full[4]))
+    pyqscore.PROCESSES = 1
+
+    # Follow mode, with the log rotated in the middle of a game: that game
+    # is dropped, and the games of the new log are the same as parsed alone
+    path = new_dir()
+    game_log = os.path.join(path, 'games.log')
+    rest = cut_log(log_file, game_log, kill)
+    rest = rest[rest.index('\n', rest.index('ShutdownGame:')) + 1:]
+    old_games = len(list(pyqscore.iter_games(pyqscore.LogReader(game_log),
+                                             pyqscore.Server())))
+    expected = [pyqscore.game_record(game) for game in pyqscore.iter_games(
+                    iter(rest.splitlines(True)), pyqscore.Server())]
+    deadline = time.time() + 60
+
+    def rotate():
+        if not os.path.exists(game_log + '.1'):
+            os.rename(game_log, game_log + '.1')
+            with open(game_log, 'wb') as f:
+                f.write(rest)
+        elif time.time() > deadline:
+            raise RuntimeError('follow mode lost games after the rotation')
+    poll, pyqscore.FOLLOW_POLL = pyqscore.FOLLOW_POLL, 0.01
+    followed = []
+
+    def follow():
+        for game in pyqscore.iter_games(pyqscore.LogFollower(
+                        game_log, on_tick=rotate), pyqscore.Server()):
+            followed.append(pyqscore.game_record(game))
+            if len(followed) == old_games + len(expected):
+                break
+    quietly(follow)
+    pyqscore.FOLLOW_POLL = poll
+    check('follow, rotated mid-game', followed[old_games:], expected)
+
+    # The archive added up again for another MINPLAY, against the log 
+    # parsed with it
+    minplay = pyqscore.MINPLAY
+    pyqscore.MINPLAY = 0.8
+    path = new_dir()
+    shutil.copy(log_file, os.path.join(path, 'games.log'))
+    expected = store_summary(os.path.join(path, 'games_stats.db'),
+                             [os.path.join(path, 'games.log')])
+    check('MINPLAY rebuild', store_summary(
+              os.path.join(reference, 'games_stats.db'),
+              [os.path.join(reference, 'games.log')]), expected)
+    pyqscore.MINPLAY = minplay
+
+    shutil.rmtree(tmp_dir)
+    if failed:
+        print '\n%d of the checks failed.\n' % len(failed)
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'child':
+        child(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'memory':
+        bench_memory()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'scaling':
+        bench_scaling()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'rebuild':
+        bench_rebuild()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'games':
+        bench_games()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'items':
+        bench_items()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'render':
+        bench_render()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'leaderboards':
+        bench_leaderboards()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'verify':
+        bench_verify()
+    else:
+        print ('\nUsage: python benchmark.py memory|scaling|rebuild|games|'
+               'items|render|leaderboards|verify\n')
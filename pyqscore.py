@@ -25,16 +25,38 @@ __copyright__ = "Copyright (C) 2011  Jose Rodriguez"
 
 import sys
 import os
-import shutil
+import time
+import copy
+import signal
+import multiprocessing
+import glob
+import gzip
+import bz2
 import re
 import json
-import cPickle
+import hashlib
+import heapq
+import marshal
+import struct
+import shutil
+import tempfile
+import sqlite3
 import webbrowser
 import Tkinter as Tk
 import tkFileDialog
-from operator import mod
-from datetime import timedelta, datetime
-from random import randint
+from itertools import chain, izip
+from collections import OrderedDict, defaultdict
+from operator import itemgetter
+from array import array
+from datetime import timedelta, datetime, date
+from random import Random
+try:
+    import lzma
+except(ImportError):
+    try:
+        from backports import lzma
+    except(ImportError):
+        lzma = None             # Only needed for .xz logs
 
 
 #=======================         OPTIONS         ======================= #
@@ -43,7 +65,7 @@ TK_WINDOW = True
 # Launch a Tkinter open file dialog to input log file (True/False)
 
 MOVE_HTML_OUTPUT = True
-# If True, the output file will be moved to directory html_files
+# If True, the output file will be written to directory html_files
 # This may be convenient for some people, as it will avoid problems
 # with the CSS file and icons missing.
 
@@ -52,11 +74,29 @@ MAXPLAYERS = 150
 
 SORT_OPTION = 'time'
 # How to sort table columns. Options: deaths, frag_death_ratio,
-# frags, games, ping, time, won, won_percentage
+# frags, frags_per_hour, games, name, ping (lowest first), rating, time, 
+# won, won_percentage, and the rest of the sums: assist, capture, defence,
+# excellent, hand, impressive, suics, wfrags
+
+LEADERBOARDS = ['frags', 'won_percentage', 'frag_death_ratio', 
+                'frags_per_hour', 'time', 'ping', 'rating']
+# Rankings of the top MAXPLAYERS players, besides SORT_OPTION, written to
+# the JSON file (see JSON_DATA). Same options as SORT_OPTION.
+
+BREAKDOWN_PLAYERS = 5
+# Number of best players of each map and game type, by SORT_OPTION in the
+# maps and game types tables of the HTML output, and by each leaderboard 
+# in the JSON file. 0 for no tables of maps and game types.
+
+PERIODS = [1, 7, 30]
+# Numbers of days for the stats of the last days, reported like the maps
+# (see BREAKDOWN_PLAYERS): today, last week and last month. The new games 
+# of each run count for the day the log was last modified.
 
 BAN_LIST = [ 'UnnamedPlayer', 'a_player_I_dont_like' ]
-# Comma-separated list containing the nicks of undesired players.
-# Nicks must include the colour codes and be inside quotes. 
+# Comma-separated list containing the nicks of undesired players, inside 
+# quotes. Colour codes don't matter. Client GUIDs can be given too, for
+# servers that log them.
 
 MINPLAY = 0.5
 # From 0 to 1, minimum fraction of time a player has to play in a game
@@ -74,6 +114,10 @@ OPEN_BROWSER = True
 DUMP_DATA = ''
 # Dump processed data to file in JSON format by setting this to 'yes'
 
+JSON_DATA = True
+# Write the stats of every player, not only the MAXPLAYERS in the HTML 
+# output, next to it in a compact JSON file (True/False)
+
 GTYPE_OVERRIDE = ''
 # If you have a mixed log with different game types, this will override
 # the game type read from the log. You can type what you want here.
@@ -82,32 +126,82 @@ DISPLAY_CTF_TABLE = True
 # Display or not the CTF table in the HTML output. This will only work
 # if there are players with CTF-related data (True/False)
 
+DISPLAY_ITEMS_TABLE = True
+# Display or not the table of armor, mega health and power-up pickups in 
+# the HTML output (True/False)
+
+DISPLAY_VERSUS_TABLE = True
+# Display or not the table of the nemesis (who fragged the player most) 
+# and favourite victim of each player in the HTML output (True/False)
+
+PROCESSES = 1
+# Number of processes used to parse big logs. Each one parses a different
+# set of games, and the results are the same as with a single process.
+# 0 means one per CPU core.
+
+FOLLOW = False
+# Keep running and follow the log like 'tail -F' does, updating the stats
+# as each game ends. Also enabled by passing --follow (True/False)
+
+FOLLOW_DELAY = 30
+# In follow mode, maximum number of seconds between a game ending and the
+# HTML output being regenerated. The HTML is not rewritten more often.
+
+STATS_DB = ''
+# SQLite database where the stats are kept between runs. If empty, it goes
+# next to the log, with the name of the HTML output: games_stats.db
+
 
 # ====================================================================== #
 
+FINGERPRINT_SIZE = 1024
+# Bytes of log hashed at its start and before the resume offset, to tell
+# whether it is still the log we read last time
+
+CHUNK_SIZE = 1 << 20
+# Bytes read from the log at a time
+
+FOLLOW_POLL = 1
+# Seconds to wait for new data when following the log
+
+PARALLEL_MIN = 32 << 20
+# Bytes of new log below which PROCESSES is ignored. Not worth the bother.
+
+
+# Openers for compressed logs, by file extension
+COMPRESSED = {'.gz': gzip.open, '.bz2': bz2.BZ2File}
+if lzma is not None:
+    COMPRESSED['.xz'] = lzma.open
+
+
+class Game(object):
+    '''Class with no methods used to store game data.
+
+    Kept small, there may be lots of them: attributes are slots, and the 
+    event counts of each player are fixed places of one array('I'), see 
+    NO_COUNTS.'''
+    __slots__ = ('number', 'mapname', 'gametype', 'pos', 'players', 'pid', 
+                 'nicks', 'handicap', 'teams', 'counts', 'versus', 'ptime', 
+                 'time', 'validp', 'quotes', 'ctfscores', 'valid', 'ended')
 
-class Game:
-    '''Class with no methods used to store game data.'''
     def __init__(self,number):
         self.number = number            # game number
         self.mapname  = []
-        self.players  = {}              # nick: (ping, position)   
-        self.pid      = {}              # player id
+        # Players are kept by name, see player_key(), not by nick
+        self.players  = {}              # name: (ping, position)   
+        self.pid      = {}              # client id: name
+        self.nicks    = {}              # name: last nick seen
         self.handicap = {}
         self.teams    = {}
-        self.scores   = []
-        self.awards   = {}
-        self.itemsp   = {}
-        self.killsp   = {}             # world frags and suicides
-        self.deathsp  = {}             # deaths caused by other players
-        self.ctf      = {}             # 0: flag taken; 1: capture
-                                       # 2:flag return; 3: flag fragged
-        self.killsp['<world>'] = []
+        self.counts   = {}              # name: event counts, see NO_COUNTS
+        self.versus   = defaultdict(int)  # (killer, victim): frags
         self.ptime    = {}             # Player time
         self.time     = 0              # Game time 
-        self.validp   = []             # Valid game flag
+        self.validp   = set()          # Valid players
         self.quotes   = set()
-        self.weapons  = {}
+        self.ctfscores = None          # (red, blue)
+        self.valid    = False          # Game reached completion
+        self.ended    = False          # ShutdownGame line read
 
 
 class Server:
@@ -119,113 +213,514 @@ class Server:
         self.gtype = 0
 
 
-def check_args(log_file=None):
-    '''Checks arguments and existence of input file, returns it if OK'''
-    if log_file is None:
-        argv = sys.argv
+def check_args(log_files=None):
+    '''Checks arguments and existence of input files. Returns the 
+    arguments and the log files they stand for, if OK.
+
+    Log files can be given as paths or globs, like "logs/games.log*", and
+    may be compressed with gzip, bzip2 or xz.'''
+    global FOLLOW
+    if log_files is None:
+        argv = [arg for arg in sys.argv if arg != '--follow']
+        if len(argv) < len(sys.argv):
+            FOLLOW = True
         if len(argv) < 2:
             print '\nPlease specify log file to be processed.\n'
             raise SystemExit
         else:
-            log_file = argv[1]
-    try:
-        file_in = open(log_file, 'r')
-    except(IOError):
-        print '\nCould not open log file. Exiting...\n'
+            log_files = argv[1:]
+    elif isinstance(log_files, basestring):
+        log_files = [log_files]
+    paths = []
+    for pattern in log_files:
+        for log_file in sorted(glob.glob(pattern)) or [pattern]:
+            # Globs like games.log* also match our own output files
+            if log_file.endswith(('_cache.p', '.html', '.json', '.db',
+                                  '.db-journal', '.games')):
+                continue
+            if log_file.endswith('.xz') and lzma is None:
+                print '\nCannot read ' + log_file + ' without lzma. Exiting...\n'
+                raise SystemExit
+            try:
+                file_in = open_log(log_file)
+            except(IOError):
+                print '\nCould not open log file ' + log_file + '. Exiting...\n'
+                raise SystemExit
+            else:            
+                file_in.close()
+            if log_file not in paths:
+                paths.append(log_file)
+    if len(paths) == 0:
+        print '\nNo log files found. Exiting...\n'
         raise SystemExit
-    else:            
-        file_in.close()
-    return log_file
+    return log_files, paths
+
+
+def open_log(log_file):
+    '''Open a log file for reading, decompressing it if needed'''
+    opener = COMPRESSED.get(os.path.splitext(log_file)[1], open)
+    return opener(log_file, 'rb')
+
+
+def is_compressed(log_file):
+    return os.path.splitext(log_file)[1] in ('.gz', '.bz2', '.xz')
+
+
+# Wildcards of globs, see report_base()
+GLOB_MAGIC = re.compile('[*?[]')
+
+
+def report_base(log_files):
+    '''Path, without extension, of the HTML and JSON output for some logs.
+
+    log_files are the arguments, paths or globs, not the files a glob 
+    matches at the time: games.log and games.log* both give games, and 
+    keep giving it when games.log is rotated into games.log.1, so the 
+    report and the stats store don't move. Several arguments, or a glob 
+    with no name before its first wildcard, give pyqscore.'''
+    if len(log_files) == 1:
+        directory, name = os.path.split(log_files[0])
+        name = GLOB_MAGIC.split(name)[0].rstrip('.')
+        if name != '':
+            return os.path.join(directory, os.path.splitext(name)[0])
+    return os.path.join(os.path.dirname(log_files[0]), 'pyqscore')
+
 
+def store_path(log_files):
+    '''SQLite stats store used for some logs, given as the arguments, see 
+    report_base() and STATS_DB'''
+    if STATS_DB != '':
+        return STATS_DB
+    return report_base(log_files) + '_stats.db'
 
-def check_cache(log_file):
-    '''Checks cache file.
+
+def log_key(log_file):
+    '''How a log is known in the stats store: its absolute path'''
+    return os.path.abspath(log_file)
+
+
+def check_store(db, log_file):
+    '''Checks what the stats store knows about a log.
     
     Returns
     -------
-    cache: unpickled cache (empty if cache not present)
-    
-    Cache files are simple pickled Python lists that store data from 
-    previously processed log files. They speed up the processing time greatly.
-    
-    The last elements of the cache store some needed metadata:
+    offset: byte offset to resume reading the log from, or None if there is
+            nothing new to read in it
     
-    - position [-1]: size in bytes of the log file from the previous run
-    - position [-2]: number of lines read from log up to the previous run
-    - position [-3]: a Server() instance with accumulated server data
-    - position [-3]: accumulated list of unique quotes
+    The logs table keeps, for every log, the byte offset where the last run
+    stopped, just after a game, the device and inode of the file, and 
+    fingerprints of its first bytes and of the bytes just before the 
+    offset. 
     
-    The rest of the elements store accumulated player data.
-    
-    The size of the log file is checked every run, and if found to be smaller 
-    than what the cache file indicates, it is assumed that the log has been 
-    overwritten and the cache is discarded.
+    The log is only resumed if it is still the same file (inode), at least as
+    big as the stored offset, and both fingerprints match. Otherwise it is 
+    assumed that the log has been rotated or overwritten and everything 
+    stored for it is dropped. All of this takes a stat() and two small reads
+    however big the log is. Compressed logs can't be resumed: the offset is
+    the size of the whole file, and they are only read again if it changed.
     '''    
-    cache_file = str(log_file[:-4]) + '_cache.p'
-    cache = []
+    row = db.execute('SELECT offset, fingerprint, device, inode, head '
+                     'FROM logs WHERE log = ?', (log_key(log_file),)).fetchone()
+    if row is None:
+        print '\nLog not found in stats store. Will process the entire log file.'
+        return 0
+    offset, fingerprint, device, inode, head = row
+    st = os.stat(log_file)
+    if (st.st_dev, st.st_ino) != (device, inode):
+        print '\nLog file has been replaced by a new one (rotated?)'
+        print 'Processing the entire log file.\n'
+        return forget_log(db, log_file)
+    if st.st_size < offset:
+        print '\nLog file size is smaller than the stored one!'
+        print 'Processing the entire log file.\n'
+        return forget_log(db, log_file)
+    if is_compressed(log_file) and st.st_size != offset:
+        print '\nCompressed log file has changed since the last run!'
+        print 'Processing the entire log file.\n'
+        return forget_log(db, log_file)
+    if (log_fingerprint(log_file, min(offset, FINGERPRINT_SIZE)) != head or 
+        log_fingerprint(log_file, offset) != fingerprint):
+        print '\nLog file has changed since the last run!'
+        print 'Processing the entire log file.\n'
+        return forget_log(db, log_file)
+    if is_compressed(log_file):
+        print '\nCompressed log file already processed.'
+        return None
+    print '\nLog found in stats store!\n' + str(offset) + ' bytes already processed'
+    return offset
+
+
+def follow_renames(db, log_files):
+    '''Move the stored data of logs that have been renamed, as logrotate 
+    does with games.log -> games.log.1, to their new names.
+
+    A log is taken to be renamed when one of log_files is the file, same 
+    device, inode and first bytes, stored under another name. That way a 
+    rotated log is just resumed, and its last games are not missed. A log
+    which is gone or replaced is also taken to be renamed when one of 
+    log_files new to the store is a compressed copy of all that was read of
+    it, see is_copy(), as logrotate's compress and delaycompress leave 
+    them. Its games are then not read again. If the compressed log holds
+    more than that, the log is forgotten instead, see forget_log(), and 
+    the compressed log read in full.
+
+    A log stored under the new name is gone: its days and games are kept,
+    for the periods and ratings, under a name of its own, see 
+    retired_key(), and the rest is dropped.'''
+    files = {}
+    for log_file in log_files:
+        st = os.stat(log_file)
+        files[(st.st_dev, st.st_ino)] = log_file
+    rows = db.execute('SELECT log, offset, fingerprint, device, inode, head '
+                      'FROM logs').fetchall()
+    known = set(files.get((row[3], row[4])) for row in rows)
+    copies = [log_file for log_file in log_files 
+              if is_compressed(log_file) and log_file not in known]
+    moves = []
+    for key, offset, fingerprint, device, inode, head in rows:
+        log_file = files.get((device, inode))
+        if log_file is not None and log_key(log_file) == key:
+            continue
+        if (log_file is not None and 
+            log_fingerprint(log_file, min(offset, FINGERPRINT_SIZE)) == head):
+            print '\n' + key + ' is now ' + log_file
+            moves.append((key, log_key(log_file)))
+            continue
+        for log_file in copies:
+            if is_copy(log_file, offset, fingerprint, head, whole=False):
+                if is_copy(log_file, offset, fingerprint, head):
+                    print '\n' + key + ' is now ' + log_file
+                    moves.append((key, log_key(log_file)))
+                else:
+                    print '\n' + key + ' is now ' + log_file + ', read again'
+                    forget_log(db, key)
+                copies.remove(log_file)
+                break
+    if len(moves) == 0:
+        return
+    retired = dict((new_key, retired_key(db, new_key)) 
+                   for key, new_key in moves)
+    # Names can go round, games.log.1 -> games.log.2 while games.log -> 
+    # games.log.1, so everything is moved out of the way first.
+    with db:
+        for table in LOG_TABLES:
+            for key, new_key in moves:
+                db.execute('UPDATE %s SET log = ? WHERE log = ?' % table,
+                           ('moving ' + new_key, key))
+            for key, new_key in moves:
+                if table in ('player_days', 'games'):
+                    db.execute('UPDATE %s SET log = ? WHERE log = ?' % table,
+                               (retired[new_key], new_key))
+                else:
+                    db.execute('DELETE FROM %s WHERE log = ?' % table, 
+                               (new_key,))
+                db.execute('UPDATE %s SET log = ? WHERE log = ?' % table,
+                           (new_key, 'moving ' + new_key))
+        # Compressed copies are read to the end, see process_log()
+        for key, new_key in moves:
+            if is_compressed(new_key):
+                st = os.stat(new_key)
+                db.execute('UPDATE logs SET offset = ?, fingerprint = ?, '
+                           'size = ?, device = ?, inode = ?, head = ? '
+                           'WHERE log = ?', 
+                           (st.st_size, log_fingerprint(new_key, st.st_size),
+                            st.st_size, st.st_dev, st.st_ino, 
+                            log_fingerprint(new_key, min(st.st_size, 
+                                                         FINGERPRINT_SIZE)),
+                            new_key))
+
+
+def log_fingerprint(log_file, offset):
+    '''MD5 of the FINGERPRINT_SIZE bytes of the log just before offset.
+
+    Cheap to compute (one seek and one small read) and good enough to tell
+    whether the log we resume is the one we read last time.'''
+    start = max(0, offset - FINGERPRINT_SIZE)
+    with open(log_file, 'rb') as f:
+        f.seek(start)
+        block = f.read(offset - start)
+    return hashlib.md5(block).hexdigest()
+
+
+def is_copy(log_file, offset, fingerprint, head, whole=True):
+    '''Is log_file, a compressed log, a copy of a stored log read up to 
+    offset, whose fingerprints are fingerprint and head, see check_store()?
+
+    It has to hold the same bytes, decompressed, as far as the fingerprints
+    go, and if whole is True nothing after offset: compressed logs can't 
+    be resumed.'''
+    with open_log(log_file) as f:
+        block = f.read(min(offset, FINGERPRINT_SIZE))
+        if hashlib.md5(block).hexdigest() != head:
+            return False
+        start = max(0, offset - FINGERPRINT_SIZE)
+        f.seek(start)
+        block = f.read(offset - start)
+        return (len(block) == offset - start and 
+                (whole is False or f.read(1) == '') and
+                hashlib.md5(block).hexdigest() == fingerprint)
+
+
+def retired_key(db, key):
+    '''Name for the days and games of a log that is gone, once another log
+    takes its name, so that they still count in the periods and ratings: 
+    "games.log.1 (retired 1)", then 2 and so on for the next ones.'''
+    prefix = key + ' (retired '
+    n = db.execute('SELECT COUNT(DISTINCT log) FROM games '
+                   'WHERE substr(log, 1, ?) = ?', 
+                   (len(prefix), prefix)).fetchone()[0]
+    return prefix + str(n + 1) + ')'
+
+
+class LogReader:
+    '''Lazily yields the lines of a log file, reading it in chunks.
+
+    Nothing but the current chunk is kept in memory. offset is the position 
+    in bytes just after the last line handed out, and count the number of 
+    lines handed out so far. A trailing line without its newline is still 
+    being written by the server, so it is left for the next run. If end is
+    given, reading stops at the line starting at that offset. checkpoint
+    is kept by iter_games(): the offset just after the last game that 
+    ended, where it is safe to resume reading next time.'''
+    def __init__(self, log_file, offset=0, chunk_size=CHUNK_SIZE, end=None):
+        self.log_file   = log_file
+        self.offset     = offset
+        self.checkpoint = offset
+        self.chunk_size = chunk_size
+        self.count      = 0
+        self.end        = end
+
+    def __iter__(self):
+        with open_log(self.log_file) as f:
+            f.seek(self.offset)
+            tail = ''
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()          # Incomplete line, if any
+                for line in lines:
+                    if self.end is not None and self.offset >= self.end:
+                        return
+                    self.offset += len(line) + 1
+                    self.count  += 1
+                    yield line + '\n'
+
+
+class LogFollower(LogReader):
+    '''Yields the lines of a log file forever, like 'tail -F'.
+
+    When the end of the file is reached it waits for new data. If the log is
+    rotated (a new file appears under the same name) or truncated, it starts
+    again from the beginning of the new log. on_tick() is called after every
+    chunk and every time we wait, so the caller gets a chance to do its 
+    thing even when no lines arrive. on_rotate() is called when the old log
+    is done with, before any line of the new one.'''
+    def __init__(self, log_file, offset=0, on_tick=None, on_rotate=None,
+                 chunk_size=CHUNK_SIZE):
+        LogReader.__init__(self, log_file, offset, chunk_size)
+        self.on_tick = on_tick
+        self.on_rotate = on_rotate
+
+    def tick(self):
+        if self.on_tick is not None:
+            self.on_tick()
+
+    def rotated(self, f):
+        '''Has the file been replaced or truncated under our feet?'''
+        try:
+            st = os.stat(self.log_file)
+        except(OSError):
+            return False            # Not there yet, keep reading the old one
+        return (st.st_ino != os.fstat(f.fileno()).st_ino or 
+                st.st_size < self.offset)
+
+    def __iter__(self):
+        while True:
+            f = open(self.log_file, 'rb')
+            f.seek(self.offset)
+            tail = ''
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    if self.rotated(f):
+                        break
+                    self.tick()
+                    time.sleep(FOLLOW_POLL)
+                    continue
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()
+                for line in lines:
+                    self.offset += len(line) + 1
+                    self.count  += 1
+                    yield line + '\n'
+                self.tick()
+            f.close()
+            print '\nLog file rotated. Following the new one.\n'
+            self.offset = 0
+            self.checkpoint = 0
+            if self.on_rotate is not None:
+                self.on_rotate()
+
+
+def mainProcessing(log, games=None):
+    '''Main processing function. log is any iterable of lines.
+
+    Each game is added to the player totals as soon as it ends and then 
+    forgotten, so memory use doesn't grow with the number of games. If 
+    games is given, a list or a GameSpool, the record of each game is 
+    appended to it, see game_record().'''
+    server  = Server()
+    players = {}             # Accumulated player stats, see add_record()
+    quotes  = set()
+    for game in iter_games(log, server):
+        record = game_record(game)
+        add_record(players, record)
+        quotes.update(game.quotes)
+        if games is not None:
+            games.append(record)
+    return server, players, quotes
+
+
+def parallelProcessing(log_file, offset=0, processes=None):
+    '''Like mainProcessing(), with the log split between several processes.
+
+    Each process parses the games within a byte range of the log, see 
+    game_boundaries(), and the results are merged in log order. Returns 
+    the same as mainProcessing(), then the game records in a GameSpool,
+    the offset to resume from next time and the number of lines read.'''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    bounds = game_boundaries(log_file, offset, 4 * processes)
+    jobs = [(log_file, start, end) for start, end in 
+            zip(bounds, bounds[1:] + [None])]
+    server  = Server()
+    players = {}
+    quotes  = set()
+    games   = GameSpool()
+    count   = 0
+    pool = multiprocessing.Pool(processes)
     try:
-        cache = cPickle.load(open(cache_file, 'rb'))
-    except(IOError):
-        print '\nNo cache file found. Will process the entire log file.'
-        cache_present = False
-    else:
-        if os.path.getsize(log_file) < cache[-1][1]:
-            print '\nLog file size is smaller than the cached one!'
-            print 'Processing the entire log file.\n'
-            cache_present = False
-        else:
-            N = cache[-2][1]      # lines read stored at position [-2]
-            print '\nCache file found!\n' + str(N) + ' lines already processed'
-            cache_present = True
-    return cache
-
-
-def read_log(log_file, cache=[]):
-    '''Reads log file and outputs dictionary storing lines.
-    
-    If cache file is present only new lines are considered'''
-    if len(cache) != 0:
-        Nlines = cache[-1][1]
-    else:
-        Nlines = 1
-
-    log = {}
-    count = 1
-    k_new = 0
+        for result in pool.imap(parse_range, jobs):
+            (part_server, part_players, part_quotes, part_games, offset, 
+             lines) = result
+            merge_server(server, part_server)
+            merge_totals(players, part_players)
+            quotes.update(part_quotes)
+            games.extend(part_games)
+            count += lines
+    finally:
+        pool.close()
+        pool.join()
+    return server, players, quotes, games, offset, count
+
+
+def parse_range(job):
+    '''Parse the games of a byte range of the log. Run by worker processes.'''
+    log_file, start, end = job
+    log = LogReader(log_file, start, end=end)
+    games = GameSpool()
+    server, players, quotes = mainProcessing(log, games)
+    return server, players, quotes, games, log.checkpoint, log.count
+
+
+def game_boundaries(log_file, offset, parts):
+    '''Split the log from offset into about parts pieces.
+
+    Returns the start offsets of the pieces. Each piece but the first
+    starts just after a ShutdownGame line, where mainProcessing() is not 
+    in the middle of any game, so the pieces can be parsed independently.
+    Only a few lines around each cut need to be read.'''
+    size = os.path.getsize(log_file)
+    bounds = [offset]
+    with open(log_file, 'rb') as f:
+        for i in xrange(1, parts):
+            guess = offset + (size - offset) * i // parts
+            if guess <= bounds[-1]:
+                continue
+            f.seek(guess)
+            f.readline()                        # Skip to the next line
+            previous = None      # The skipped one may have been an InitGame
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    break
+                # A ShutdownGame right after an InitGame is taken as the 
+                # warmup check line by iter_games(), so no cutting there,
+                # nor before the line before is known.
+                if (previous is not None and 
+                    line_event(line) == 'ShutdownGame' and
+                    line_event(previous) != 'InitGame'):
+                    if f.tell() > bounds[-1]:
+                        bounds.append(f.tell())
+                    break
+                previous = line
+    return bounds
+
+
+def combine_servers(servers):
+    '''Server data with the totals of several logs, in order.
+
+    The totals are also broken out per host name in the hosts attribute,
+    as {hostname: [frags, time]}.'''
+    total = Server()
+    total.hosts = {}
+    for server in servers:
+        if not hasattr(server, 'hostname'):     # No games in that log
+            continue
+        merge_server(total, server)
+        host = total.hosts.setdefault(server.hostname, [0, 0])
+        host[0] += server.frags
+        host[1] += server.time
+    return total
+
+
+def merge_server(server, other):
+    '''Add server data in other, from a later part of the log, to server'''
+    server.frags += other.frags
+    server.time  += other.time
+    if hasattr(other, 'hostname'):              # It saw some games
+        server.hostname = other.hostname
+        server.gtype    = other.gtype
+    return server
 
-    with open(log_file, 'r') as f:
-        for line in f:
-            if count < Nlines:
-                # Ignore lines from previous runs
-                pass
-            else:
-                log[count] = line
-                k_new += 1
-            count += 1
-    print  '\n' + str(k_new) + ' new lines read.\n'
-    return log, count
 
+def iter_games(log, server):
+    '''Yield valid games from log as soon as each one ends.
 
-def mainProcessing(log):
-    '''Main processing function'''
-    server = Server()
-    cgames = []              # Cumulative list of games: instances of Game()
+    server is updated as we go.
+    
+    A game only counts once its ShutdownGame line is read: the log may end
+    in the middle of a game, even after the scores, when the server is 
+    still writing it. Such a game is left for the next run, which resumes
+    at log.checkpoint if log is a LogReader, and its frags are taken off 
+    server once the log runs out. A game that never ends because another
+    one starts, after a server crash or a log rotation in follow mode, is
+    dropped.'''
     N = 1                    # Game number
-    lines = (line for line in log.values())
-    for line in lines:
-        if line.find(' InitGame: ') > 0 and lines.next().find(' Warmup:') == -1:
+    frags = server.frags     # Server frags up to the last game that ended
+    lines = iter(log)
+    line = next(lines, None)
+    while line is not None:
+        if line.find(' InitGame: ') > 0 and next(lines, '').find(' Warmup:') == -1:
             # New game started (no warmup). Begin to parse stuff
             game = Game(N)
             N += 1
             game.pos = 1          # Player's score position
             game, server = lineProcInit(line, game, server)
-            game, server, valid_game = oneGameProc(lines, game, server)
-            if valid_game == True:
-                if len(game.players) == 0:
-                    continue
+            game, server, line = oneGameProc(lines, game, server)
+            if line is not None:
+                continue                    # Start over with the new game
+            if game.ended is False:
+                break                           # Out of lines
+            frags = server.frags
+            if hasattr(log, 'checkpoint'):
+                log.checkpoint = log.offset
+            if game.valid is True and len(game.players) > 0:
                 server.time = server.time + game.time - min(game.ptime.values())
-                cgames.append(game)               # Append game to list of games
-    return server, cgames
+                yield game
+        line = next(lines, None)
+    server.frags = frags
 
 
 def lineProcInit(line, game, server):
@@ -243,8 +738,10 @@ def lineProcInit(line, game, server):
     hostname = line[idx:idx+50].split('\\')[1]  # Does this always work?
     server.hostname = hostname                  # I hope so anyway
     
-    idx = line.find('g_gametype')
-    game.gametype = line[idx+11]
+    # One or two digits: game types go up to 12 (Domination)
+    regex = re.compile('g_gametype[\\\\](\d+)')
+    result = regex.search(line)
+    game.gametype = result.group(1) if result else '0'
     try:
         server.gtype = int(game.gametype)
     except(ValueError):
@@ -253,93 +750,137 @@ def lineProcInit(line, game, server):
 
         
 def oneGameProc(lines, game, server):
-    '''Process lines from one single game'''
-    valid_game = False
+    '''Process lines from one single game, up to its ShutdownGame line.
+
+    If an InitGame line comes first, the game never ended and that line is
+    returned along with game and server, else None is.'''
     for line in lines:
-        # Process more frequent lines first: Items >> Kill > Userinfo > Awards
-        if line.find(' Item: ') > 0:
-            # I don't need items at the moment, so pass and save a lot of time.
-            # If they are needed the following function provide everything 
-            # required to keep track of the items collected by each player.
-            #game = lineProcItems(line, game)
-            continue
-        elif line.find(' Kill: ') > 0:        
-            game, server = lineProcKills(line, game, server)
-        elif line.find(' CTF: ') > 0:
-            game = lineProcCTF(line, game)
-        elif line.find(' Award: ') > 0:
-            game = lineProcAwards(line, game)            
-        elif line.find('UserinfoChanged') > 0:
-            game = lineProcUserInfo(line, game)
-        elif line.find(' say:') > 0:
-            game = lineProcQuotes(line, game)
-        elif line.find(' score: ') > 0:
-            game = lineProcScores(line, game)
-        elif line.find(' red:') > 0:
-            # 20:33 red:4  blue:5
-            game.ctfscores = (line[11], line[19])
-        elif ((line.find('Exit: Timelimit hit') > 0) or      
-              (line.find('Exit: Fraglimit hit') > 0) or    
-              (line.find('Exit: Capturelimit hit') > 0)):
-            # Game completed. Make a note of the time and flag it as valid.
-            e_idx = line.find('Exit')
-            game.time = totime(line[0:e_idx])
-            valid_game = True
-        elif line.find(' ShutdownGame:') > 0:
+        event = line_event(line)
+        if event in EVENT_HANDLERS:
+            game, server = EVENT_HANDLERS[event](line, game, server)
+        elif event == 'ShutdownGame':
+            game.ended = True
             break
-    return game, server, valid_game
+        elif event == 'InitGame':
+            return game, server, line
+    return game, server, None
+
+
+def line_event(line):
+    '''Return the event keyword of a log line.
+
+    Lines look like "mmm:ss Keyword: stuff", so the keyword sits between 
+    the blank after the time and the next colon:
+    
+      3:20 Kill: 3 2 10: Gargoyle killed Gargoyle by MOD_RAILGUN -> 'Kill'
+     20:33 red:4  blue:5                                          -> 'red'
+    '''
+    start = line.find(':') + 4
+    return line[start:line.find(':', start)]
+
+
+def register_event(event, handler):
+    '''Make oneGameProc() call handler for lines of the given event.
+    
+    handler(line, game, server) must return (game, server). Replaces any
+    handler already registered for the event.'''
+    EVENT_HANDLERS[event] = handler
 
 
-def lineProcItems(line, game):
+def lineProcTeamScores(this_line, game, server):
+    '''Process team scores lines'''
+    # 20:33 red:4  blue:5
+    red, blue = this_line.split(':')[2:4]
+    game.ctfscores = (int(red.split()[0]), int(blue))
+    return game, server
+
+
+def lineProcExit(this_line, game, server):
+    '''Process game exit lines'''
+    #  9:20 Exit: Timelimit hit.
+    if ((this_line.find('Exit: Timelimit hit') > 0) or      
+        (this_line.find('Exit: Fraglimit hit') > 0) or    
+        (this_line.find('Exit: Capturelimit hit') > 0)):
+        # Game completed. Make a note of the time and flag it as valid.
+        e_idx = this_line.find('Exit')
+        game.time = totime(this_line[0:e_idx])
+        game.valid = True
+    return game, server
+
+
+def lineProcItems(this_line, game, server):
     '''Process item lines'''
     #  0:35 Item: 1 ammo_lightning
     #100:22 Item: 0 item_health
-    parts  = this_line[13:].split(' ')
-    client = parts[0]
-    item   = parts[1][:-1]
+    # Item lines are by far the most frequent ones, so this is kept cheap:
+    # only the items in ITEM_NAMES are counted, in Game.counts, and the 
+    # names of the rest (ammo, weapons, small health...) go nowhere.
+    if 'item_' not in this_line:
+        return game, server
     # try/except clause to avoid rare cases of damaged logs. 
     # Items assigned to player who currently owns specified id.
     # In case of client disconnection this may give an erroneous 
     # count, a circumstance minimised by only storing players with
     # a minimum playing time. See game.validp in lineProcScores().
     try:
-        game.itemsp[game.pid[client]].append(item)
-    except:
+        client, item = this_line.split(None, 4)[2:4]
+        index = ITEM_INDEX.get(item)
+        if index is not None:
+            game.counts[game.pid[client]][index] += 1
+    except(ValueError, KeyError):
         pass
-    return game
+    return game, server
+
+
+# Means of death, indexed by the MOD number in Kill lines (OpenArena).
+MOD_NAMES = ['UNKNOWN', 'SHOTGUN', 'GAUNTLET', 'MACHINEGUN', 'GRENADE',
+             'GRENADE_SPLASH', 'ROCKET', 'ROCKET_SPLASH', 'PLASMA', 
+             'PLASMA_SPLASH', 'RAILGUN', 'LIGHTNING', 'BFG', 'BFG_SPLASH', 
+             'WATER', 'SLIME', 'LAVA', 'CRUSH', 'TELEFRAG', 'FALLING', 
+             'SUICIDE', 'TARGET_LASER', 'TRIGGER_HURT', 'NAIL', 'CHAINGUN',
+             'PROXIMITY_MINE', 'KAMIKAZE', 'JUICED', 'GRAPPLE']
+
+# MOD numbers of the weapon columns kept per player, in the order used by 
+# game records and make_weapons_table(). Only these count as frags.
+WEAPON_MODS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 18, 23, 24]
+FRAG_MODS   = frozenset(WEAPON_MODS)
+
+# Names of those columns and of the CTF ones in the stats store and records
+WEAPON_COLUMNS = list('w%d' % m for m in WEAPON_MODS)  # By MOD number
+CTF_COLUMNS = ['ctf_taken', 'ctf_returned', 'ctf_fragged']
+# Items whose pickups are counted, and their columns
+ITEM_NAMES   = ['item_armor_combat', 'item_health_mega', 'item_quad', 
+                'item_regen', 'item_haste']
+ITEM_COLUMNS = ['armor', 'mega', 'quad', 'regen', 'haste']
+
+WORLD_ID = '1022'                # Client id of '<world>' in Kill lines
 
 
 def lineProcKills(this_line, game, server):
     '''Process kill lines'''
     #  3:20 Kill: 3 2 10: Gargoyle killed Gargoyle by MOD_RAILGUN
-    #100:04 Kill: 0 1 11: ^4kernel panic killed Kyonshi by MOD_PLASMA
-    k_idx  = this_line.find(' killed ')
-    # If somebody's nick contains the string ' killed ',
-    # we're screwed
-                
-    regex  = re.compile('\d:[\s](.*)')         # Fragger's nick
-    try:
-        # Does this really need a try/except clause?
-        killer = regex.search(this_line[17:k_idx]).group(1)
-    except:
-        return game, server
-                
-    d_idx  = k_idx + 6
-    b_idx  = this_line.rfind(' b')
-    killed = this_line[d_idx + 2:b_idx]           # Victim
-    weapon = this_line[b_idx + 7 + 1:-1]          # Weapon
+    #100:04 Kill: 0 1 11: ^4kernel panic killed Kyonshi by MOD_LIGHTNING
+    # Only the numbers are used: killer id, victim id and MOD number. 
+    # Players are looked up by client id, so nicks can contain anything.
     # try statement needed to avoid rare cases of damaged logs:
     # We're looking stuff up on a dictionary, so if the line is
     # broken the key may not exist and python complains
     try:
-        if killer == killed:
-            game.killsp[killer].append(weapon)
-        elif killer != '<world>':
-            game.weapons[killer][weapon[0:3]] = (
-                                    game.weapons[killer][weapon[0:3]] + 1)
+        killer_id, victim_id, mod = this_line.split(None, 5)[2:5]
+        mod    = int(mod[:-1])
+        victim = game.pid[victim_id]
+        killed = game.counts[victim]
+        if killer_id == victim_id:
+            killed[SUICS] += 1
+        elif killer_id == WORLD_ID:
+            killed[WFRAGS] += 1
+        elif mod in FRAG_MODS:
+            killer = game.pid[killer_id]
+            game.counts[killer][WEAPONS_AT + WEAPON_INDEX[mod]] += 1
+            game.versus[killer, victim] += 1
         else:
-            game.killsp['<world>'].append(killed)
-        game.deathsp[killed] = game.deathsp[killed] + 1
+            return game, server
+        killed[DEATHS] += 1
     except:
         pass
     else:
@@ -347,7 +888,7 @@ def lineProcKills(this_line, game, server):
     return game, server
 
 
-def lineProcCTF(this_line, game):
+def lineProcCTF(this_line, game, server):
     '''Process CTF lines'''
     #  9:40 CTF: 1 1 3: Inhakitor fragged RED's flag carrier!
     # 10:18 CTF: 3 1 0: Mynard Killman got the RED flag!
@@ -356,37 +897,65 @@ def lineProcCTF(this_line, game):
     event = this_line[16]              
     # 0: flag taken; 1: flag cap; 
     # 2: flag return; 3: flag carrier fragged
+    # Captures are not counted here, there is an award for them.
     try:
-        game.ctf[game.pid[p_id]][event] = game.ctf[game.pid[p_id]][event] + 1
+        game.counts[game.pid[p_id]][CTF_AT + CTF_EVENTS[event]] += 1
     except:
         pass
-    return game
+    return game, server
 
 
-def lineProcAwards(this_line, game):
+def lineProcAwards(this_line, game, server):
     '''Process line awards lines'''
+    client, award = parse_award(this_line)
+    try:
+        game.counts[game.pid[client]][AWARDS_AT + AWARD_INDEX[award]] += 1
+    except:
+        pass
+    return game, server
+
+
+def parse_award(this_line):
+    '''Return client id and award letter of an award line'''
     #  3:02 Award: 4 2: Grunt gained the IMPRESSIVE award!
     # 11:02 Award: 2 1: Kyonshi gained the EXCELLENT award!
+    # The id, rather than the nick, which may have spaces and colour codes
     g_idx = this_line.find(' gained ')
-    regex = re.compile('\d:\s(\S*\s?\S*)')        # Player name
-    result = regex.search(this_line[0:g_idx])
     # Assist, Capture, Defence, Impressive, Excellent 
-    name, award = [result.group(1), this_line[g_idx+12:g_idx+13]]
-    try:
-        game.awards[name][award] = game.awards[name][award] + 1
-    except:
-        pass
-    return game
+    return this_line.split(None, 3)[2], this_line[g_idx+12:g_idx+13]
+
+
+# Colour codes in nicks: ^ and any character but another ^, like Q_IsColorString
+COLOUR_CODE = re.compile(r'\^[^^]')
+PLAYER_GUID = re.compile(r'\\id\\([0-9A-Fa-f]+)')
+
+
+def plain_name(nick):
+    '''nick without colour codes'''
+    return COLOUR_CODE.sub('', nick)
 
 
-def lineProcUserInfo(this_line, game):
+def player_key(nick, guid=None):
+    '''Name a player is kept by, in games and in the stats store: the 
+    client GUID, if the userinfo line has one, else the nick without colour
+    codes. So recolouring a nick doesn't make a new player, and neither 
+    does a new nick with the same GUID. Nicks to show are kept apart, see
+    Game.nicks.'''
+    if guid:
+        return guid
+    return plain_name(nick)
+
+
+def lineProcUserInfo(this_line, game, server):
     '''Process user info lines'''
     #  0:05 ClientUserinfoChanged: 0 n\kernel\t\3\model\sarge/classic\hmodel\sarge/classic\g_redteam\\g_blueteam\\c1\3\c2\5\hc\100\w\0\l\0\tt\0\tl\0
     #103:22 ClientUserinfoChanged: 1 n\Kyonshi\t\0\model\kyonshi\hmodel\kyonshi\c1\4\c2\5\hc\100\w\0\l\0\skill\    5.00\tt\0\tl\0
     regex    = re.compile('Changed:[\s]([\d]*)')    # client id
     new_id   = regex.search(this_line).group(1)
     regex    = re.compile('n\\\\([^\\\\]*)')        # client name
-    new_name = regex.search(this_line).group(1)
+    new_nick = regex.search(this_line).group(1)
+    guid     = PLAYER_GUID.search(this_line)     # Only some servers log it
+    new_name = player_key(new_nick, guid and guid.group(1))
     try:
         regex    = re.compile('\\\\hc\\\\(\d*)')    # handicap
         handicap = regex.search(this_line).group(1)
@@ -396,36 +965,32 @@ def lineProcUserInfo(this_line, game):
     regex    = re.compile('\\\\t\\\\(\d)')    
     team     = regex.search(this_line).group(1)
 
-    if new_name not in game.pid.values():
-        # Initialize dictionaries for new player
-        game.itemsp[new_name]   = []
-        game.killsp[new_name]   = []
-        game.deathsp[new_name]  = 0
-        game.awards[new_name]   = {'A': 0, 'C': 0, 'D': 0, 'E': 0, 'I': 0 }
-        game.handicap[new_name] = handicap
-        game.teams[new_name]    = team
-        game.ctf[new_name]      = {'0': 0, '1': 0, '2': 0, '3': 0}
-        game.weapons[new_name]  = {'SHO': 0, 'GAU': 0, 'MAC': 0, 'GRE': 0, 
-                                   'ROC': 0, 'PLA': 0, 'RAI': 0, 'LIG': 0, 
-                                   'BFG': 0, 'TEL': 0, 'NAI': 0, 'CHA': 0 }
-        
+    if new_name not in game.ptime:
+        # Initialize data for new player
+        game.counts[new_name]   = array('I', NO_COUNTS)
         c_idx = this_line.find('ClientU')
         game.ptime[new_name]    = totime(this_line[0:c_idx])
-        # Keep track of player's current id
-        game.pid[new_id] = new_name
-    return game
+    # Players change teams, e.g. from spectator to red, and handicap as 
+    # they play: the last ones are kept
+    game.handicap[new_name] = handicap
+    game.teams[new_name]    = team
+    # Keep track of player's current id, also when a known player 
+    # comes back with a different one, and of the nick to show
+    game.pid[new_id] = new_name
+    game.nicks[new_name] = new_nick
+    return game, server
 
 
-def lineProcQuotes(this_line, game):
+def lineProcQuotes(this_line, game, server):
     '''Process quotes lines'''
     #  2:03 say: ^2ONAK: joder otra vez no
     name = this_line.split(':')[2]
     bs = this_line.split(':')[3][0:-1]
     game.quotes.add( (name,bs) )
-    return game
+    return game, server
 
         
-def lineProcScores(this_line, game):
+def lineProcScores(this_line, game, server):
     '''Process scores lines'''
     #  5:40 score: 6  ping: 85  client: 2 Iagoi
     # 10:14 score: 12  ping: 62  client: 2 Iagoi
@@ -435,292 +1000,974 @@ def lineProcScores(this_line, game):
     [time, score, ping, client, nick] = [result.group(1), result.group(2),
                                          result.group(3), result.group(4),
                                          result.group(5)]
+    if client not in game.pid:
+        return game, server
+    name = game.pid[client]
                 
-    game.scores.append([time, score, ping, client, nick])
-    game.players[nick] = (ping, game.pos)
+    game.players[name] = (ping, game.pos)
     game.pos += 1                   # Increase position for next player
     # Players are considered 'valid' if time played is greater than a 
     # percentage of the time played by the 1st player who joined the game. 
     # This: a) minimises the possibility of wrong item assignment due to 
     # multiple connections and disconnections; b) results in fairer statistics
-    if (game.time - game.ptime[nick]) > MINPLAY * (game.time -
+    if (game.time - game.ptime[name]) > MINPLAY * (game.time -
                                                    min(game.ptime.values())):
-        game.validp.append(nick)
-    return game
+        game.validp.add(name)
+    return game, server
 
 
 def totime(string):
     '''Convert strings of the format mmm:ss to an int of seconds'''
     mins, secs = string.split(':')
-    time = timedelta(minutes = int(mins), seconds = int(secs)).seconds
-    return time
-
-
-def csum(A):
-    """Column-wise addition of lists. Returns a list."""
-    # Check whether A is multidimensional
-    if type(A[0]) is not list and type(A[0]) is not tuple:
-        S = A
-        return S
-    # Check that A is not jagged
-    for row in A:
-        if len(row) != len(A[0]):
-            print "Not square..."
-    # Do the damn summation cause Python can't be bothered to do it alone
-    S = []
-    for i in range(len(A[0])):
-        S.append(sum([row[i] for row in A]))
-    return S
-
-
-def get_quotes(cgames):
-    '''Create non repeating list of quotes from list of games.'''
-    if len(cgames) != 0:
-        quotes_list = [cgames[i].quotes for i in xrange(len(cgames)) if
-                       cgames[i].quotes != []]
-        quotes_list = list(set([item for sublist in quotes_list for 
-                                item in sublist]))
-    else:
-        quotes_list = []
-    return quotes_list
-
-
-def allnames(cgames):
-    """Return names of all valid players in log."""
-    allnames = set()
-    for game in cgames:
-        allnames.update(game.validp)
-    return allnames
-
-
-def player_stats_total(cgames):
-    """Get accumulated stats per player for all players in log.""" 
-    all_players = []
-    for name in allnames(cgames):
-        win, time = 0, 0
-        hand, ping, weapon_count, ctf_events = [], [], [], []
-        frags, deaths, suics, wfrags = 0, 0, 0, 0
-        awards_a, awards_c, awards_d, awards_e, awards_i = 0, 0, 0, 0, 0
-        items = []
-        for i in xrange(len(cgames)):
-            if name not in cgames[i].validp:        # ignore no valid players
-                pass
-            else:
-                game_stats = player_stats(cgames, i, name)
-                win      = win      + game_stats[1]
-                time     = time     + game_stats[2]
-                hand.append(int(game_stats[3]))                
-                ping.append(int(game_stats[4]))
-                frags    = frags    + game_stats[5]
-                deaths   = deaths   + game_stats[6]
-                suics    = suics    + game_stats[7]
-                wfrags   = wfrags   + game_stats[8]
-                awards_a = awards_a + game_stats[9][0]
-                awards_c = awards_c + game_stats[9][1]
-                awards_d = awards_d + game_stats[9][2]
-                awards_e = awards_e + game_stats[9][3]
-                awards_i = awards_i + game_stats[9][4]
-                weapon_count.append(game_stats[10])
-                ctf_events.append(game_stats[11])
-                #items.append(game_stats[12])
-        if frags == 0:
-            # Take rid of players with autodownload 'off' who 
-            # appear to join the server momentarily.
-            pass
+    # Same as timedelta(minutes=mins, seconds=secs).seconds, only faster
+    return (int(mins) * 60 + int(secs)) % 86400
+
+
+# Handlers for each event keyword, see oneGameProc(). Lines of any other
+# event are skipped.
+EVENT_HANDLERS = {'Kill':                  lineProcKills,
+                  'CTF':                   lineProcCTF,
+                  'Award':                 lineProcAwards,
+                  'Item':                  lineProcItems,
+                  'ClientUserinfoChanged': lineProcUserInfo,
+                  'say':                   lineProcQuotes,
+                  'score':                 lineProcScores,
+                  'red':                   lineProcTeamScores,
+                  'Exit':                  lineProcExit}
+
+
+# Layout of the numbers kept per player in a game record, see game_record()
+RECORD_FIELDS = ['ptime', 'position', 'ping', 'hand', 'team', 'suics', 
+                 'wfrags', 'deaths', 'assist', 'capture', 'defence', 
+                 'excellent', 'impressive'] + WEAPON_COLUMNS + CTF_COLUMNS + \
+                ITEM_COLUMNS
+COUNTS_START = RECORD_FIELDS.index('suics')  # Where the event counts begin
+AWARDS_START = RECORD_FIELDS.index('assist')
+WEAPONS_START = RECORD_FIELDS.index(WEAPON_COLUMNS[0])
+CTF_START = RECORD_FIELDS.index(CTF_COLUMNS[0])
+ITEMS_START = RECORD_FIELDS.index(ITEM_COLUMNS[0])
+WEAPON_INDEX = dict((mod, i) for i, mod in enumerate(WEAPON_MODS))
+
+# Places in the event counts of a player in a game, Game.counts, which are 
+# the end of RECORD_FIELDS. Counts start at zero, like NO_COUNTS.
+SUICS, WFRAGS, DEATHS = 0, 1, 2
+AWARDS_AT  = AWARDS_START - COUNTS_START
+WEAPONS_AT = WEAPONS_START - COUNTS_START
+CTF_AT     = CTF_START - COUNTS_START
+ITEMS_AT   = ITEMS_START - COUNTS_START
+NO_COUNTS  = array('I', [0] * (len(RECORD_FIELDS) - COUNTS_START))
+AWARD_INDEX = {'A': 0, 'C': 1, 'D': 2, 'E': 3, 'I': 4}  # Letter in Award lines
+CTF_EVENTS  = {'0': 0, '2': 1, '3': 2}   # Flag taken, returned, fragged
+# Item name in Item lines: its place in Game.counts. Items are told apart 
+# by these small ints from here on, names are never stored.
+ITEM_INDEX  = dict((item, ITEMS_AT + i) for i, item in enumerate(ITEM_NAMES))
+
+# What is added up for each player, see PlayerTotals. These are also the
+# columns of the players table of the stats store, with ping_min/ping_max.
+SUM_COLUMNS = ['games', 'won', 'time', 'hand', 'frags', 'deaths', 'suics', 
+               'wfrags', 'assist', 'capture', 'defence', 'excellent', 
+               'impressive']
+ADD_COLUMNS = (SUM_COLUMNS + ['ping_sum'] + WEAPON_COLUMNS + CTF_COLUMNS + 
+               ITEM_COLUMNS)
+NO_CTF = [0] * len(CTF_COLUMNS)
+NO_SUMS = [0] * len(ADD_COLUMNS)
+
+
+class PlayerTotals(object):
+    """Stats of a player added up over any number of games.
+
+    Only sums are kept, in an array in the order of ADD_COLUMNS, plus the
+    lowest and highest ping. Averages are worked out at the very end, see 
+    report(). So totals from different games, logs, servers or worker 
+    processes can be merged exactly, in any order, with merge()."""
+    __slots__ = ('name', 'sums', 'ping_min', 'ping_max')
+
+    def __init__(self, name, sums=None, ping_min=None, ping_max=0):
+        self.name     = name
+        self.sums     = array('L', sums or NO_SUMS)
+        self.ping_min = ping_min
+        self.ping_max = ping_max
+
+    def add(self, sums, ping_min, ping_max):
+        """Add sums, in the order of ADD_COLUMNS, and ping extremes."""
+        self.sums = array('L', [a + b for a, b in zip(self.sums, sums)])
+        if self.ping_min is None or ping_min < self.ping_min:
+            self.ping_min = ping_min
+        self.ping_max = max(self.ping_max, ping_max)
+
+    def merge(self, other):
+        """Add the totals of the same player in other. Returns self."""
+        self.add(other.sums, other.ping_min, other.ping_max)
+        return self
+
+    def row(self):
+        """Values of the player columns of the stats store"""
+        return self.sums.tolist() + [self.ping_min, self.ping_max]
+
+    def report(self):
+        """Dictionary of stats as used to write the HTML and JSON output,
+        with handicap and ping averages."""
+        player = dict(zip(SUM_COLUMNS, self.sums))
+        n, w, c = len(SUM_COLUMNS), len(WEAPON_COLUMNS), len(CTF_COLUMNS)
+        games = player['games']
+        player['id']      = self.name          # See player_key()
+        player['name']    = self.name          # Nick to show, see player_list()
+        player['rating']  = RATING_START       # See player_list() too
+        player['hand']    = player['hand'] / games
+        player['ping']    = [self.ping_min, self.sums[n] / games, 
+                             self.ping_max]
+        player['weapons'] = self.sums[n+1:n+1+w].tolist()
+        player['ctf']     = self.sums[n+1+w:n+1+w+c].tolist()
+        player['items']   = self.sums[n+1+w+c:].tolist()
+        return player
+
+
+def game_record(game):
+    """Compact record of a complete game, with everything needed to add up 
+    its player stats again, whatever MINPLAY is, see add_record().
+
+    It is a tuple: map name, game type, game time, time the first player 
+    joined, team scores (or None), names of the players with a score and
+    their numbers as an array('I') string, len(RECORD_FIELDS) per player,
+    then who fragged whom as another one: killer, victim and frags for 
+    each pair of them, killer and victim given as their places in names,
+    and last the nicks of those players, see player_key(). So it is the 
+    same whether the game is in memory or in the archive."""
+    names = sorted(game.players)
+    numbers = array('I')
+    for name in names:
+        ping, position = game.players[name]
+        numbers.extend([game.ptime[name], position, int(ping), 
+                        int(game.handicap[name]), int(game.teams[name])])
+        numbers.extend(game.counts[name])
+    index = dict((name, i) for i, name in enumerate(names))
+    pairs = array('I')
+    for (killer, victim), frags in game.versus.iteritems():
+        if killer in index and victim in index:
+            pairs.extend((index[killer], index[victim], frags))
+    return (game.mapname, game.gametype, game.time, min(game.ptime.values()),
+            game.ctfscores, tuple(names), numbers.tostring(), 
+            pairs.tostring(), tuple(game.nicks.get(name, name) 
+                                    for name in names))
+
+
+def add_record(players, record):
+    """Add the stats of every valid player in a game record to players, a 
+    dictionary of PlayerTotals keyed by (name, mapname, gametype), so the 
+    totals of each map and game type are kept apart, see totals_by_name().
+    Players are valid if they played long enough, see MINPLAY."""
+    mapname, gametype, gtime, start, ctfscores, names, numbers = record[:7]
+    numbers = array('I', numbers)
+    n = len(RECORD_FIELDS)
+    for i, name in enumerate(names):
+        row = numbers[i*n:(i+1)*n]
+        ptime, position, ping, hand, team = row[:COUNTS_START]
+        if not (gtime - ptime) > MINPLAY * (gtime - start):
+            continue
+        if gametype not in ('3', '4'):
+            won = int(position == 1)
         else:
-            one_player = {'name':name,  'games':len(hand),  'won':win,
-                          'time':time,  'hand':sum(hand)/len(hand), 
-                          'ping': [min(ping), sum(ping)/len(ping), max(ping)],
-                          'frags':frags, 'deaths':deaths, 'suics':suics,
-                          'wfrags':wfrags, 'excellent':awards_e, 
-                          'impressive':awards_i, 'defence':awards_d,
-                          'capture':awards_c,  'assist':awards_a,
-                          'weapons':csum(weapon_count), 
-                          'ctf':csum(ctf_events)}
-                          #'items':csum(items)}
-            all_players.append(one_player)
-    return all_players
-
-
-def player_stats(cgames, game_number, player_name):
-    """Gather the relevant numbers on a per-game, per-player basis."""
-    game = cgames[game_number]
-    
-    if player_name not in game.validp:
-    # Check player has actually played game and is tagged as valid
-        return 0
-    
-    time = game.time - game.ptime[player_name]
-    ping = game.players[player_name][0]
-    hand = game.handicap[player_name]
+            try:        # We 'try' it to avoid problems with spectators
+                won = int(ctfscores[team - 1] == max(ctfscores))
+            except(IndexError, TypeError):
+                won = 0
+        suics, wfrags, deaths = row[COUNTS_START:AWARDS_START]
+        weapons = row[WEAPONS_START:CTF_START]
+        if gametype == '4':
+            ctf = row[CTF_START:ITEMS_START].tolist()
+        else:
+            ctf = NO_CTF
+        sums = ([1, won, gtime - ptime, hand, sum(weapons), deaths, suics, 
+                 wfrags] + row[AWARDS_START:WEAPONS_START].tolist() + 
+                [ping] + weapons.tolist() + ctf + 
+                row[ITEMS_START:].tolist())
+        key = (name, mapname, gametype)
+        if key not in players:
+            players[key] = PlayerTotals(name)
+        players[key].add(sums, ping, ping)
+    return players
+
+
+def add_versus(versus, record):
+    """Add who fragged whom in a game record to versus, a dictionary of 
+    frags keyed by (killer, victim). Only frags between valid players are
+    counted, see add_record(). Memory goes with the number of pairs of 
+    players who fragged each other, not with the square of players."""
+    gtime, start, ctfscores, names, numbers, pairs = record[2:8]
+    numbers = array('I', numbers)
+    n = len(RECORD_FIELDS)            # ptime goes first in each player's row
+    valid = [(gtime - numbers[i*n]) > MINPLAY * (gtime - start) 
+             for i in xrange(len(names))]
+    pairs = array('I', pairs)
+    for i in xrange(0, len(pairs), 3):
+        killer, victim, frags = pairs[i:i+3]
+        if valid[killer] and valid[victim]:
+            pair = (names[killer], names[victim])
+            versus[pair] = versus.get(pair, 0) + frags
+    return versus
+
+
+# Elo ratings, see rate_game()
+RATING_START = 1500.
+RATING_K     = 32.
+
+
+def rate_game(ratings, record):
+    """Update ratings, a dictionary of Elo ratings keyed by name, with the
+    result of a game record. Every valid player, see add_record(), is 
+    compared with every other one: in team games with those of the other
+    team, by team score, and otherwise by score position. A player's 
+    rating moves by RATING_K times the comparisons won (half for a draw)
+    less those expected from the ratings, over the number of comparisons,
+    so big games don't move ratings more than small ones. Players start at
+    RATING_START. Games must be rated in the order they were played."""
+    gametype, gtime, start, ctfscores, names, numbers = record[1:7]
+    numbers = array('I', numbers)
+    n = len(RECORD_FIELDS)
+    teams = gametype in ('3', '4') and ctfscores is not None
+    players = []                # (name, team, place), lower places better
+    for i, name in enumerate(names):
+        ptime, position, ping, hand, team = numbers[i*n:i*n+COUNTS_START]
+        if not (gtime - ptime) > MINPLAY * (gtime - start):
+            continue
+        if not teams:
+            players.append((name, None, position))
+        elif team in (1, 2):          # Not spectators
+            players.append((name, team, -ctfscores[team - 1]))
+    old = [ratings.get(name, RATING_START) for name, team, place in players]
+    for i, (name, team, place) in enumerate(players):
+        score = expected = 0.
+        compared = 0
+        for j, (other, other_team, other_place) in enumerate(players):
+            if i == j or (teams and team == other_team):
+                continue
+            if place < other_place:
+                score += 1.
+            elif place == other_place:
+                score += 0.5
+            expected += 1. / (1. + 10. ** ((old[j] - old[i]) / 400.))
+            compared += 1
+        if compared != 0:
+            ratings[name] = old[i] + RATING_K * (score - expected) / compared
+    return ratings
+
+
+def merge_totals(players, other):
+    """Add the player totals in other to players, both dictionaries of 
+    PlayerTotals with the same keys. Returns players."""
+    for key, player in other.iteritems():
+        if key in players:
+            players[key].merge(player)
+        else:
+            players[key] = player
+    return players
 
-    if (game.gametype != '4') and (game.gametype != '3'):
-        if game.players[player_name][1] == 1:
-            win = 1
+
+def totals_by_name(players):
+    """PlayerTotals keyed by (name, mapname, gametype), see add_record(), 
+    added up into new ones keyed by name."""
+    totals = {}
+    for (name, mapname, gametype), player in players.iteritems():
+        if name in totals:
+            totals[name].merge(player)
         else:
-            win = 0
-    else:
-        try:             # We 'try' it to avoid problems with spectators
-            if game.ctfscores[int(game.teams[player_name]) - 1] == max(game.ctfscores):
-                win = 1
-            else:
-                win = 0
-        except(IndexError):
-            win = 0
-        
-    awards = []
-    awards.extend([n[1] for n in
-                   sorted(game.awards[player_name].iteritems())])
-    wfrags = [n for n in game.killsp['<world>']].count(player_name)
-    deaths = game.deathsp[player_name]
-    suics  = len([n for n in game.killsp[player_name]])
-    frags  = sum( game.weapons[player_name].values() )
-    weapons = [n[1] for n in game.killsp[player_name] if n[0] != player_name]
-    weapon_count = []   # per weapon frags
-       
-    wlist = ['SHOTGUN', 'GAUNTLET', 'MACHINEGUN', 'GRENADE', 'GRENADE_SPLASH',
-             'ROCKET', 'ROCKET_SPLASH', 'PLASMA', 'PLASMA_SPLASH', 'RAILGUN',
-             'LIGHTNING', 'BFG10K', 'BFG10K_SPLASH', 'TELEFRAG', 'NAIL','CHAIN']
-    for w in wlist:
-        weapon_count.append(game.weapons[player_name][w[0:3]])
-
-    if game.gametype == '4':
-        flags_taken = game.ctf[player_name]['0']
-        #flags_captd = game.ctf[player_name].count('1')  # equal to cap award
-        flags_retrd = game.ctf[player_name]['2']
-        flag_fraggd = game.ctf[player_name]['3']
-        ctf_events  = (flags_taken, flags_retrd, flag_fraggd)
-    else:
-        ctf_events = (0, 0, 0)
-    
-    #armor = game.itemsp[player_name].count('item_armor_combat')
-    #mega  = game.itemsp[player_name].count('item_health_mega')
-    #quad  = game.itemsp[player_name].count('item_quad')
-    #regen = game.itemsp[player_name].count('item_regen')
-    #haste = game.itemsp[player_name].count('item_haste')
-    #items = [armor, mega, quad, regen, haste]
-
-    key = ['win', 'time', 'handicap', 'ping', 'frags', 'deaths', 'suics',
-           'wfrags', 'awards', 'weapon count', 'ctf_events'] #, 'items']
-
-    return [key, win, time, hand, ping, frags, deaths, suics, 
-            wfrags, awards, weapon_count, ctf_events] #/map, items]
-
-
-def addFromCache(cgames, quotes_list, cache):
-    '''Add cached data to player statistics'''
-    server_old = cache[-3]               # Make a copy of server data in cache
-    quotes_list.extend(cache[-4])        # Add previous quotes to current list
-    quotes_list = list(set(quotes_list)) # Eliminate duplicates
-    del cache[-4:]                       # Get rid of extra bits in cache file
-    R_old = cache                        # Make a copy of previous player data
-
-    if len(cgames) == 0:
-        R = R_old                   # No new data, just use the cache
-        server = server_old         # Ditto for server data
-    else:
-        # If there are new games in log, add new data to that from the cache
-        R = player_stats_total(cgames)   # Process new player data from log
-        server_old.frags = server_old.frags + server.frags
-        server_old.gtype = server.gtype  # This we don't add, we update it
-        server_old.time  = server_old.time + server.time
-        old_names = [player['name'] for player in R_old]
-        keys = R[0].keys()
-        keys.remove('name')
-        keys.remove('ping')
-        keys.remove('weapons')
-        keys.remove('ctf')
-        keys.remove('hand')
+            totals[name] = PlayerTotals(name, player.sums, player.ping_min,
+                                        player.ping_max)
+    return totals
+
+
+def player_list(players, nicks=None, ratings=None):
+    """List of per player stats dictionaries from PlayerTotals keyed by 
+    name, see PlayerTotals.report(). Sorted by name, so the order doesn't
+    depend on how the totals were put together. nicks are the nicks to 
+    show keyed by name, see read_nicks(): names not in them show as they
+    are. ratings are those of rate_game(), keyed by name too."""
+    R = [players[name].report() for name in sorted(players)]
+    if nicks:
         for player in R:
-            if player['name'] in old_names:
-                index = old_names.index(player['name'])
-                min_ping = min( R_old[index]['ping'][0], player['ping'][0] )
-                max_ping = max( R_old[index]['ping'][2], player['ping'][2] )
-                avg_png1 = R_old[index]['ping'][1]
-                avg_png2 = player['ping'][1]
-                games1   = R_old[index]['games']
-                games2 = player['games']
-                ave_ping = (avg_png1*games1 + avg_png2*games2)/(games1 + games2)
-                R_old[index]['ping'] = [min_ping, ave_ping, max_ping]
-                R_old[index]['weapons'] = csum([ R_old[index]['weapons'],
-                                                 player['weapons'] ])
-                R_old[index]['ctf']  = csum([ R_old[index]['ctf'], 
-                                              player['ctf'] ] )
-                avg_han1 = R_old[index]['hand']
-                avg_han2 = player['hand']
-                R_old[index]['hand'] = (avg_han1*games1 +
-                                        avg_han2*games2) / (games1+games2)
-                for key in keys:
-                    R_old[index][key] = csum( [ [R_old[index][key]],
-                                                [player[key]] ] )[0]
-            else:
-                R_old.append(player)
-        R = R_old
-        server = server_old   
-    return R, quotes_list, server
-
-
-def writeCache(R, newlines, server, quotes_list, log_file):
-    '''Write cache file from updated statistics'''
-    cache = R
-    log_size = os.path.getsize(log_file)
-    date_now = datetime.now().strftime("%c")
-    cache.append(quotes_list)
-    cache.append(server)
-    cache.append(('lines read',newlines - 1))
-    cache.append(('Log size on ' + date_now, log_size))
-    cache_file = str(log_file[:-4]) + '_cache.p'
-    cPickle.dump(cache, open(cache_file, 'wb'))
-
-
-def results_ordered(R, option, maxnumber):
-    '''Sort the dictionary-storing list R according to the key specified
-    by option. The inexistent keys 'frag_death_ratio' and 'won_percentage'
-    are added here for convenience. maxnumber limits the size of the
-    output.'''
-    if is_number(maxnumber) is False:
-        print "\nINVALID MAXNUMBER VALUE IN results_ordered()"
-        print "Check MAXPLAYERS option.\n"
-        return
-    if maxnumber > len(R):
-        maxnumber = len(R)
-    elif maxnumber <= 0:
-        print "\nINVALID MAXNUMBER VALUE IN results_ordered()"
-        print "Check MAXPLAYERS option.\n"
+            player['name'] = nicks.get(player['id'], player['id'])
+    if ratings:
+        for player in R:
+            player['rating'] = ratings.get(player['id'], RATING_START)
+    return R
+
+
+STORE_VERSION = 8                # Bump when STORE_SCHEMA changes
+LOG_TABLES    = ['logs', 'servers', 'players', 'player_days', 'versus', 
+                 'games', 'quotes']       # Per log
+STORE_TABLES  = LOG_TABLES + ['nicks', 'ratings', 'settings', 'fragments']
+STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    log TEXT PRIMARY KEY, offset INTEGER, fingerprint TEXT, size INTEGER,
+    updated TEXT, device INTEGER, inode INTEGER, head TEXT);
+CREATE TABLE IF NOT EXISTS servers (
+    log TEXT PRIMARY KEY, hostname TEXT, gtype INTEGER, frags INTEGER, 
+    time INTEGER);
+CREATE TABLE IF NOT EXISTS players (
+    log TEXT, name TEXT, mapname TEXT, gametype TEXT, %(columns)s, 
+    ping_min INTEGER, ping_max INTEGER, 
+    PRIMARY KEY (log, name, mapname, gametype));
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE TABLE IF NOT EXISTS player_days (
+    log TEXT, day INTEGER, name TEXT, %(columns)s, ping_min INTEGER, 
+    ping_max INTEGER, PRIMARY KEY (log, day, name));
+CREATE INDEX IF NOT EXISTS player_days_day ON player_days (day);
+CREATE TABLE IF NOT EXISTS versus (
+    log TEXT, killer TEXT, victim TEXT, frags INTEGER, 
+    PRIMARY KEY (log, killer, victim));
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY, log TEXT, mapname TEXT, gametype TEXT, 
+    time INTEGER, players INTEGER, archive INTEGER, day INTEGER);
+CREATE INDEX IF NOT EXISTS games_log ON games (log);
+CREATE INDEX IF NOT EXISTS games_mapname ON games (mapname);
+CREATE INDEX IF NOT EXISTS games_day ON games (day);
+CREATE TABLE IF NOT EXISTS quotes (
+    log TEXT, name TEXT, quote TEXT, PRIMARY KEY (log, name, quote));
+CREATE TABLE IF NOT EXISTS nicks (name TEXT PRIMARY KEY, nick TEXT);
+CREATE TABLE IF NOT EXISTS ratings (name TEXT PRIMARY KEY, rating REAL);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS fragments (
+    report TEXT, section TEXT, hash TEXT, html TEXT, 
+    PRIMARY KEY (report, section));
+''' % {'columns': ', '.join(column + ' INTEGER' for column in ADD_COLUMNS)}
+# Player columns added up over the rows of a group, see read_store()
+TOTALS_SELECT = (', '.join('SUM(%s)' % c for c in ADD_COLUMNS) + 
+                 ', MIN(ping_min), MAX(ping_max)')
+
+
+def totals_sql(table, keys):
+    '''Statements to add to the player columns of a row of table: UPDATE,
+    and INSERT for when there is no such row yet. Both take the values of 
+    PlayerTotals.row() and then those of the columns in keys.'''
+    update = ('UPDATE %s SET ' % table + 
+              ', '.join('%s = %s + ?' % (c, c) for c in ADD_COLUMNS) +
+              ', ping_min = MIN(ping_min, ?), ping_max = MAX(ping_max, ?)'
+              ' WHERE ' + ' AND '.join(key + ' = ?' for key in keys))
+    insert = ('INSERT INTO %s (%s) VALUES (%s)' % 
+              (table, ', '.join(ADD_COLUMNS + ['ping_min', 'ping_max'] + keys),
+               ', '.join('?' * (len(ADD_COLUMNS) + 2 + len(keys)))))
+    return update, insert
+
+PLAYER_UPDATE, PLAYER_INSERT = totals_sql('players', ['log', 'name', 
+                                                      'mapname', 'gametype'])
+DAY_UPDATE, DAY_INSERT = totals_sql('player_days', ['log', 'day', 'name'])
+
+
+def open_store(db_file):
+    '''Open the SQLite stats store, creating its tables if needed.
+
+    If MINPLAY changed since the last run, the player stats are added up 
+    again from the game archive, see rebuild_store().'''
+    db = sqlite3.connect(db_file, timeout=60)
+    db.text_factory = str            # Nicks are whatever bytes the log has
+    if db.execute('PRAGMA user_version').fetchone()[0] != STORE_VERSION:
+        # New, or written by another pyqscore version: start from scratch
+        for table in STORE_TABLES:
+            db.execute('DROP TABLE IF EXISTS ' + table)
+        db.execute('PRAGMA user_version = %d' % STORE_VERSION)
+    db.executescript(STORE_SCHEMA)
+    minplay = get_setting(db, 'minplay')
+    if minplay is not None and minplay != repr(MINPLAY):
+        print '\nMINPLAY has changed. Adding up the stats again from the games'
+        print 'stored in ' + archive_path(db) + '\n'
+        rebuild_store(db)
+    set_setting(db, 'minplay', repr(MINPLAY))
+    return db
+
+
+def get_setting(db, key):
+    row = db.execute('SELECT value FROM settings WHERE key = ?', 
+                     (key,)).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def set_setting(db, key, value):
+    with db:
+        db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', 
+                   (key, value))
+
+
+def forget_log(db, log_file):
+    '''Drop everything stored for a log. Returns 0, the offset to start
+    reading it again. Its games stay in the archive, but are not used.
+
+    Ratings can't be taken apart by log, so if the log had games, every 
+    game left is rated again on the next write, see store_ratings().'''
+    key = log_key(log_file)
+    with db:
+        for table in LOG_TABLES:
+            if (db.execute('DELETE FROM %s WHERE log = ?' % table, 
+                           (key,)).rowcount != 0 and table == 'games'):
+                db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                           ('ratings', 'stale'))
+    return 0
+
+
+def archive_path(db):
+    '''Game archive of a stats store: games_stats.db -> games_stats.games
+
+    The archive is an append-only file with the record of every game in the
+    store, see game_record(). Each record is marshalled and written after 
+    its size, as a 4 byte little-endian unsigned int. The games table has
+    the offset of the record of every game, and the setting archive_size
+    how far the archive is good: anything after that is left over from an
+    interrupted run and gets overwritten.'''
+    db_file = db.execute('PRAGMA database_list').fetchone()[2]
+    return os.path.splitext(db_file)[0] + '.games'
+
+
+def append_archive(db, records):
+    '''Add game records to the archive, returns their offsets.
+
+    Data is on disk when this returns, but archive_size is only updated 
+    with the caller's transaction.'''
+    archive_file = archive_path(db)
+    size = int(get_setting(db, 'archive_size') or 0)
+    mode = 'r+b' if os.path.exists(archive_file) else 'wb'
+    offsets = []
+    with open(archive_file, mode) as f:
+        f.seek(size)
+        f.truncate()
+        for record in records:
+            offsets.append(f.tell())
+            f.write(pack_record(record))
+        f.flush()
+        os.fsync(f.fileno())
+        db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', 
+                   ('archive_size', str(f.tell())))
+    return offsets
+
+
+def iter_archive(db):
+    '''Yield (offset, record) for every record in the game archive'''
+    size = int(get_setting(db, 'archive_size') or 0)
+    if size == 0:
         return
-    if option == 'frag_death_ratio':
-        Rordered = sorted(R, key = lambda dic:
-                          float(dic['frags'])/dic['deaths'], reverse=True)
-    elif option == 'won_percentage':
-        Rordered = sorted(R, key = lambda dic:
-                          float(dic['won'])/dic['games'], reverse=True)
-    elif option == 'frags_per_hour':
-        Rordered = sorted(R, key = lambda dic:
-                          float(dic['frags'])/dic['time'], reverse=True)
-    elif option == 'name':
-        Rordered = sorted(R, key = lambda dic:
-                          float(dic['frags'])/dic['deaths'], reverse=False)
-    elif option in R[0].keys():
-        Rordered = sorted(R, key = lambda dic: dic[option], reverse=True)
-    elif option not in R[0].keys():
-        print "\nINVALID ORDERING OPTION IN results_ordered()"
-        print "Check spelling?\n"
+    with open(archive_path(db), 'rb') as f:
+        for offset, record in read_records(f, size):
+            yield offset, record
+
+
+def pack_record(record):
+    '''A game record as written to the archive, size first'''
+    data = marshal.dumps(record, 2)
+    return struct.pack('<I', len(data)) + data
+
+
+def read_records(f, size):
+    '''Yield (offset, record) for the records in the first size bytes of 
+    file f, see pack_record()'''
+    offset = 0
+    while offset < size:
+        length = struct.unpack('<I', f.read(4))[0]
+        yield offset, marshal.loads(f.read(length))
+        offset += 4 + length
+
+
+class GameSpool(object):
+    '''Game records kept in a temporary file as they come, rather than in
+    memory, until they go to the stats store. They are written like in the
+    game archive, see archive_path(), and iterating yields them back in 
+    order, one at a time.
+
+    A GameSpool can be handed to another process, as the worker processes
+    of parallelProcessing() and process_logs() do: only the path of the
+    file goes. close() removes the file.'''
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='pyqscore-', suffix='.games')
+        self.file = os.fdopen(fd, 'r+b')
+        self.size = 0
+
+    def __getstate__(self):
+        self.file.flush()
+        return self.path, self.size
+
+    def __setstate__(self, state):
+        self.path, self.size = state
+        self.file = open(self.path, 'r+b')
+        self.file.seek(self.size)
+
+    def append(self, record):
+        data = pack_record(record)
+        self.file.write(data)
+        self.size += len(data)
+
+    def extend(self, other):
+        '''Add the records of another GameSpool, which is closed'''
+        other.file.seek(0)
+        shutil.copyfileobj(other.file, self.file)
+        self.size += other.size
+        other.close()
+
+    def __iter__(self):
+        self.file.flush()
+        with open(self.path, 'rb') as f:
+            for offset, record in read_records(f, self.size):
+                yield record
+
+    def close(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+def rebuild_store(db):
+    '''Add up the players table again from the game archive, and rate its
+    games again, in order.
+
+    No log is read. Logs with games missing from the archive are dropped 
+    from the store, so they are read again on the next run.'''
+    logs = dict((row[0], row[1:]) for row in 
+                db.execute('SELECT archive, log, day FROM games'))
+    totals = {}
+    days = {}
+    versus = {}
+    first = first_day()
+    try:
+        for offset, record in iter_archive(db):
+            key, day = logs.pop(offset, (None, None))
+            if key is not None:
+                add_record(totals.setdefault(key, {}), record)
+                add_versus(versus.setdefault(key, {}), record)
+                if day >= first:
+                    add_record(days.setdefault((key, day), {}), record)
+    except(IOError, EOFError, ValueError, struct.error):
+        print '\nGame archive ' + archive_path(db) + ' is damaged.\n'
+    missing = set(key for key, day in logs.itervalues())
+    for key in missing:
+        print 'Games of ' + key + ' not found. It will be read again.'
+        forget_log(db, key)
+    with db:
+        db.execute('DELETE FROM players')
+        db.execute('DELETE FROM player_days')
+        db.execute('DELETE FROM versus')
+        for key, players in totals.iteritems():
+            if key not in missing:
+                store_players(db, key, players)
+        for (key, day), players in days.iteritems():
+            if key not in missing:
+                store_days(db, key, day, players)
+        for key, pairs in versus.iteritems():
+            if key not in missing:
+                store_versus(db, key, pairs)
+        rate_store(db)
+
+
+def first_day():
+    '''First day kept in the player_days table: those of the longest of 
+    PERIODS, today included. As date.toordinal(), like the days stored.'''
+    return date.today().toordinal() - max(PERIODS or [1]) + 1
+
+
+def store_days(db, key, day, players):
+    '''Add PlayerTotals keyed by (name, mapname, gametype) to the totals of
+    a day of a log, by name'''
+    for name, player in totals_by_name(players).iteritems():
+        row = player.row() + [key, day, name]
+        if db.execute(DAY_UPDATE, row).rowcount == 0:
+            db.execute(DAY_INSERT, row)
+
+
+def store_versus(db, key, versus):
+    '''Add frags keyed by (killer, victim) to those of a log'''
+    for (killer, victim), frags in versus.iteritems():
+        row = (frags, key, killer, victim)
+        if db.execute('UPDATE versus SET frags = frags + ? WHERE log = ? AND '
+                      'killer = ? AND victim = ?', row).rowcount == 0:
+            db.execute('INSERT INTO versus (frags, log, killer, victim) '
+                       'VALUES (?, ?, ?, ?)', row)
+
+
+def store_ratings(db, games):
+    '''Rate new game records, in order, from the stored ratings of their 
+    players, see rate_game(). Only the ratings of those players are read
+    and written, so older games are never gone through again, unless a 
+    log was forgotten since: then every stored game is rated again, new
+    ones included, see rate_store(). Call after the games are stored.'''
+    if get_setting(db, 'ratings') == 'stale':
+        rate_store(db)
         return
-    return Rordered[0:maxnumber]
+    ratings = {}
+    read = set()
+    for record in games:
+        for name in set(record[5]) - read:
+            row = db.execute('SELECT rating FROM ratings WHERE name = ?', 
+                             (name,)).fetchone()
+            if row is not None:
+                ratings[name] = row[0]
+            read.add(name)
+        rate_game(ratings, record)
+    db.executemany('INSERT OR REPLACE INTO ratings VALUES (?, ?)', 
+                   ratings.iteritems())
+
+
+def rate_store(db):
+    '''Rate every game in the games table again, from the start, in the 
+    order they were stored, from the game archive. That is the order of 
+    the logs they came from, see process_logs(), so the ratings are those
+    a fresh store would have. Runs in the caller's transaction.'''
+    stored = set(row[0] for row in db.execute('SELECT archive FROM games'))
+    ratings = {}
+    if len(stored) != 0:
+        # Stop at the last stored game: anything after it is of no use,
+        # or the damaged end of the archive, see rebuild_store()
+        for offset, record in iter_archive(db):
+            if offset in stored:
+                rate_game(ratings, record)
+                stored.discard(offset)
+                if len(stored) == 0:
+                    break
+    db.execute('DELETE FROM ratings')
+    db.executemany('INSERT INTO ratings VALUES (?, ?)', ratings.iteritems())
+    db.execute('DELETE FROM settings WHERE key = ?', ('ratings',))
+
+
+def store_players(db, key, players):
+    '''Add PlayerTotals keyed by (name, mapname, gametype) to the rows of a
+    log, see add_record()'''
+    for (name, mapname, gametype), player in players.iteritems():
+        row = player.row() + [key, name, mapname, gametype]
+        if db.execute(PLAYER_UPDATE, row).rowcount == 0:
+            db.execute(PLAYER_INSERT, row)
+
+
+def write_store(db, log_file, server, players, quotes, games, offset):
+    '''Add the new games of a log to the stats store, all or nothing.
+
+    Only the rows of the players in players, the totals of the new games,
+    are touched. games are their records, a list or a GameSpool, which go
+    to the game archive one at a time, and who fragged whom is added up 
+    from them. offset is where the next run will resume the log.
+
+    The new games are all put down to the day the log was last modified,
+    and days which are too old for PERIODS are dropped, see first_day().
+    The last nick seen of each player goes to the nicks table, and the
+    new games are rated, see store_ratings(). Returns that day, as 
+    date.toordinal().'''
+    key = log_key(log_file)
+    st = os.stat(log_file)
+    day = datetime.fromtimestamp(st.st_mtime).toordinal()
+    first = first_day()
+    with db:
+        store_players(db, key, players)
+        db.execute('DELETE FROM player_days WHERE day < ?', (first,))
+        if day >= first:
+            store_days(db, key, day, players)
+        versus = {}
+        nicks = {}
+        rows = []
+        for record, archived in izip(games, append_archive(db, games)):
+            add_versus(versus, record)
+            nicks.update(zip(record[5], record[8]))
+            rows.append((key,) + record[:3] + (len(record[5]), archived, day))
+        store_versus(db, key, versus)
+        db.executemany('INSERT OR REPLACE INTO nicks VALUES (?, ?)', 
+                       nicks.iteritems())
+        if len(players) != 0:
+            row = (server.frags, server.time, server.hostname, server.gtype, 
+                   key)
+            if db.execute('UPDATE servers SET frags = frags + ?, '
+                          'time = time + ?, hostname = ?, gtype = ? '
+                          'WHERE log = ?', row).rowcount == 0:
+                db.execute('INSERT INTO servers (frags, time, hostname, '
+                           'gtype, log) VALUES (?, ?, ?, ?, ?)', row)
+        db.executemany('INSERT OR IGNORE INTO quotes VALUES (?, ?, ?)',
+                       [(key, name, quote) for name, quote in quotes])
+        db.executemany('INSERT INTO games (log, mapname, gametype, time, '
+                       'players, archive, day) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                       rows)
+        store_ratings(db, games)
+        db.execute('INSERT OR REPLACE INTO logs VALUES '
+                   '(?, ?, ?, ?, ?, ?, ?, ?)',
+                   (key, offset, log_fingerprint(log_file, offset), 
+                    st.st_size, datetime.now().strftime("%c"), st.st_dev, 
+                    st.st_ino, 
+                    log_fingerprint(log_file, min(offset, FINGERPRINT_SIZE))))
+    return day
+
+
+def read_store(db, log_files):
+    '''Stored data of some logs, added up over every map and game type.
+
+    Returns PlayerTotals keyed by name, the list of quotes and a Server 
+    per log with stored data, in order.'''
+    keys = [log_key(log_file) for log_file in log_files]
+    where = ' WHERE log IN (%s)' % ', '.join('?' * len(keys))
+    players = {}
+    for row in db.execute('SELECT name, ' + TOTALS_SELECT + ' FROM players' +
+                          where + ' GROUP BY name', keys):
+        name, row = row[0], list(row[1:])
+        players[name] = PlayerTotals(name, row[:-2], row[-2], row[-1])
+    quotes_list = db.execute('SELECT DISTINCT name, quote FROM quotes' + 
+                             where, keys).fetchall()
+    servers = []
+    for key in keys:
+        row = db.execute('SELECT hostname, gtype, frags, time FROM servers '
+                         'WHERE log = ?', (key,)).fetchone()
+        if row is not None:
+            server = Server()
+            server.hostname, server.gtype, server.frags, server.time = row
+            servers.append(server)
+    return players, quotes_list, servers
+
+
+def read_breakdown(db, log_files, column):
+    '''Stored data of some logs by map or by game type, as column says: 
+    'mapname' or 'gametype'.
+
+    Returns (value, games, time, players, totals) for each value of column,
+    most played first. players are those with a score, added up over the
+    games, and totals are PlayerTotals keyed by name, like read_store().'''
+    keys = [log_key(log_file) for log_file in log_files]
+    where = ' WHERE log IN (%s)' % ', '.join('?' * len(keys))
+    groups = OrderedDict()
+    for row in db.execute('SELECT %s, COUNT(*), SUM(time), SUM(players) '
+                          'FROM games' % column + where + 
+                          ' GROUP BY 1 ORDER BY 2 DESC, 1', keys):
+        groups[row[0]] = row + ({},)
+    for row in db.execute('SELECT %s, name, ' % column + TOTALS_SELECT + 
+                          ' FROM players' + where + ' GROUP BY 1, name', keys):
+        value, name, row = row[0], row[1], list(row[2:])
+        if value in groups:
+            groups[value][4][name] = PlayerTotals(name, row[:-2], row[-2], 
+                                                  row[-1])
+    return groups.values()
+
+
+def read_nicks(db):
+    '''Last nick seen of every player in the store, keyed by name'''
+    return dict(db.execute('SELECT name, nick FROM nicks'))
+
+
+def read_ratings(db):
+    '''Rating of every player in the store, keyed by name'''
+    return dict(db.execute('SELECT name, rating FROM ratings'))
+
+
+def read_versus(db, log_files):
+    '''Who fragged whom in some logs: (killer, victim, frags) for every pair
+    of players with frags between them'''
+    keys = [log_key(log_file) for log_file in log_files]
+    return db.execute('SELECT killer, victim, SUM(frags) FROM versus WHERE '
+                      'log IN (%s) GROUP BY killer, victim' % 
+                      ', '.join('?' * len(keys)), keys).fetchall()
+
+
+def read_periods(db):
+    '''Stored data of the last days, for each of PERIODS.
+
+    Every log the store has seen counts, not only those given this time:
+    rotated logs are often deleted well before their games are a month 
+    old, and their days are kept in the store anyway.
+
+    Returns (days, games, time, players, totals) for each period with games,
+    shortest first, like read_breakdown(). Their totals are added up from 
+    those of each day.'''
+    where = ' WHERE day >= ?'
+    periods = []
+    for days in sorted(set(PERIODS)):
+        first = date.today().toordinal() - days + 1
+        row = db.execute('SELECT COUNT(*), SUM(time), SUM(players) FROM games'
+                         + where, (first,)).fetchone()
+        if row[0] == 0:
+            continue
+        totals = {}
+        for sums in db.execute('SELECT name, ' + TOTALS_SELECT + 
+                               ' FROM player_days' + where + ' GROUP BY name',
+                               (first,)):
+            name, sums = sums[0], list(sums[1:])
+            totals[name] = PlayerTotals(name, sums[:-2], sums[-2], sums[-1])
+        periods.append((days,) + row + (totals,))
+    return periods
+
+
+class ReportData(object):
+    '''What the HTML output of some logs is written from: player totals,
+    quotes and servers, see read_store(), nicks and ratings, the games and
+    totals of each map, game type and period, see read_breakdown() and 
+    read_periods(), who fragged whom and the cached sections of the page.
+
+    It is read from the stats store once. In FOLLOW mode the new games are
+    added to it as they are stored, see add_games(), so the whole store is
+    not added up again every time the output is updated.'''
+    def __init__(self, db, log_files, report):
+        self.players, self.quotes, self.servers = read_store(db, log_files)
+        self.quoted  = set(self.quotes)
+        self.nicks   = read_nicks(db)
+        self.ratings = read_ratings(db)
+        # [games, time, players, totals] keyed by map, game type or days
+        self.groups  = {}
+        for column in ('mapname', 'gametype'):
+            self.groups[column] = dict(
+                (row[0], list(row[1:])) for row in 
+                read_breakdown(db, log_files, column))
+        self.load_periods(db)
+        self.versus = dict(((killer, victim), frags) for killer, victim, frags
+                           in read_versus(db, log_files))
+        self.fragments = dict((row[0], row[1:]) for row in 
+                              db.execute('SELECT section, hash, html FROM '
+                                         'fragments WHERE report = ?', 
+                                         (report,)))
+
+    def load_periods(self, db):
+        self.today = date.today().toordinal()
+        self.groups['periods'] = dict((row[0], list(row[1:])) for row in 
+                                      read_periods(db))
+
+    def breakdown(self, key):
+        '''(value, games, time, players, totals) of every map or game type, 
+        as key says: 'mapname' or 'gametype', most played first, like 
+        read_breakdown(). Or of every period if key is 'periods', shortest
+        first, like read_periods().'''
+        groups = self.groups[key]
+        if key == 'periods':
+            values = sorted(groups)
+        else:
+            values = sorted(groups, key=lambda value: (-groups[value][0], 
+                                                       value))
+        return [(value,) + tuple(groups[value]) for value in values]
+
+    def add_games(self, db, server, players, quotes, games, day):
+        '''Add the new games of the log, the only one of the output, as 
+        they have just been stored by write_store(): same arguments, and
+        the day it returned. Only the ratings of their players are read 
+        from the store again.'''
+        for name, quote in quotes:
+            if (name, quote) not in self.quoted:
+                self.quoted.add((name, quote))
+                self.quotes.append((name, quote))
+        if len(players) != 0:
+            if len(self.servers) == 0:
+                self.servers.append(Server())
+            merge_server(self.servers[0], server)
+        if date.today().toordinal() != self.today:
+            # The periods start on other days now. The store has the new 
+            # games already, so it is simpler to read them all again.
+            self.load_periods(db)
+            periods = ()
+        else:
+            periods = [days for days in set(PERIODS) if 
+                       day >= self.today - days + 1]
+        for record in games:
+            values = [('mapname', record[0]), ('gametype', record[1])]
+            values += [('periods', days) for days in periods]
+            for key, value in values:
+                group = self.groups[key].setdefault(value, [0, 0, 0, {}])
+                group[0] += 1
+                group[1] += record[2]
+                group[2] += len(record[5])
+            add_versus(self.versus, record)
+            self.nicks.update(zip(record[5], record[8]))
+        for (name, mapname, gametype), player in players.iteritems():
+            totals = [self.players, self.groups['mapname'][mapname][3], 
+                      self.groups['gametype'][gametype][3]]
+            totals += [self.groups['periods'][days][3] for days in periods]
+            for group in totals:
+                group.setdefault(name, PlayerTotals(name)).merge(player)
+        for name in set(name for record in games for name in record[5]):
+            row = db.execute('SELECT rating FROM ratings WHERE name = ?', 
+                             (name,)).fetchone()
+            if row is not None:
+                self.ratings[name] = row[0]
+
+
+class Inverted(object):
+    '''Wraps a sort key so that the lowest comes first'''
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+# Sort options: key of a player and whether the highest comes first. Ratios
+# of players without deaths or time count them as one.
+RANKINGS = {
+    'frag_death_ratio': (lambda dic: float(dic['frags']) / 
+                                     max(dic['deaths'], 1), True),
+    'won_percentage':   (lambda dic: float(dic['won']) / dic['games'], True),
+    'frags_per_hour':   (lambda dic: float(dic['frags']) / 
+                                     max(dic['time'], 1), True),
+    'ping':             (lambda dic: dic['ping'][1], False),
+    'rating':           (itemgetter('rating'), True),
+    'name':             (itemgetter('name'), False),
+    }
+RANKINGS.update((column, (itemgetter(column), True)) 
+                for column in SUM_COLUMNS)
+
+
+def leaderboards(R, options, maxnumber):
+    '''The top maxnumber players of the dictionary-storing list R by each
+    of the sort options, see RANKINGS. Returns a dictionary with the list
+    of players of each option, best first. Ties keep the order of R.
+
+    R is gone through once, keeping the best players so far of every option
+    in a heap of maxnumber at most, which is cheaper than sorting all of R
+    once per option when there are many more players than maxnumber. With
+    not so many, the sorts in C win, and R is sorted instead.'''
+    if is_number(maxnumber) is False or int(maxnumber) <= 0:
+        print "\nINVALID MAXNUMBER VALUE IN leaderboards()"
+        print "Check MAXPLAYERS option.\n"
+        raise SystemExit
+    maxnumber = int(maxnumber)
+    for option in options:
+        if option not in RANKINGS:
+            print "\nINVALID ORDERING OPTION IN leaderboards(): " + option
+            print "Check spelling?\n"
+            raise SystemExit
+    if len(R) <= 16 * maxnumber:
+        # Sorts are stable, reversed ones too, so ties keep the order of R
+        return dict((option, sorted(R, key=RANKINGS[option][0], 
+                                    reverse=RANKINGS[option][1])[:maxnumber])
+                    for option in set(options))
+    heaps = [(option,) + RANKINGS[option] + ([],) for option in set(options)]
+    # Entries are (key, -index, player): the index so that players are never
+    # compared, negated so that the earlier player of a tie is the higher one
+    for i, player in enumerate(R):
+        for option, key, highest, heap in heaps:
+            k = key(player)
+            if len(heap) < maxnumber:
+                heapq.heappush(heap, (k if highest else Inverted(k), -i, 
+                                      player))
+            # Only strictly better keys get in, as ties go to earlier players
+            elif highest:
+                if k > heap[0][0]:
+                    heapq.heapreplace(heap, (k, -i, player))
+            elif k < heap[0][0].key:
+                heapq.heapreplace(heap, (Inverted(k), -i, player))
+    return dict((option, [entry[2] for entry in sorted(heap, reverse=True)])
+                for option, key, highest, heap in heaps)
+
+
+# Names of the values of g_gametype
+GAMETYPES = {0: 'Death Match', 1: '1 vs 1', 2: 'Single Death Match',
+             3: 'Team Death Match', 4: 'Capture the Flag', 5: 'One-Flag CTF',
+             6: 'Overload', 7: 'Harvester', 8: 'Elimination', 
+             9: 'CTF Elimination', 10: 'Last Man Standing', 
+             11: 'Double Elimination', 12: 'Domination'}
+
+
+def gametype_name(gametype):
+    '''Name of a game type as read from the log: a number, or so it should'''
+    try:
+        return GAMETYPES[int(gametype)]
+    except(ValueError, KeyError):
+        return gametype
 
 
 def set_gametype(server):
     # Stats only tested with game types 0 and 4, but we'll
     # report the correct game type in any case.
-    gametypes = {0: 'Death Match', 1: '1 vs 1', 2: 'Single Death Match',
-                3: 'Team Death Match', 4: 'Capture the Flag', 5: 'One-Flag CTF',
-                6: 'Overload', 7: 'Harvester', 8: 'Elimination', 
-                9: 'CTF Elimination', 10: 'Last Man Standing', 
-                11: 'Double Elimination', 12: 'Domination'}
 
     # If user specifies game type, report it regardless of what pyqscore parsed
     if GTYPE_OVERRIDE in '':
-        server.gtype = gametypes[server.gtype]
+        server.gtype = GAMETYPES[server.gtype]
     elif GTYPE_OVERRIDE in ['ctf', 'CTF']:
         server.gtype = 'Capture the Flag'
     elif GTYPE_OVERRIDE in ['dm', 'DM']:
@@ -732,24 +1979,88 @@ def set_gametype(server):
     return server
 
     
-def dumpJsonfile(R):
-    dump_file = log_file[:-4] + '_dump.json'
+def dumpJsonfile(R, report):
+    dump_file = report + '_dump.json'
     f = open(dump_file, 'w')
     json.dump(R, f, sort_keys = True)
     f.close()
 
 
+# Columns of the players in the JSON data, see json_data()
+JSON_COLUMNS = (['name', 'id'] + SUM_COLUMNS + 
+                ['ping_min', 'ping', 'ping_max'] + 
+                list(MOD_NAMES[m].lower() for m in WEAPON_MODS) + 
+                CTF_COLUMNS + ITEM_COLUMNS + 
+                ['nemesis', 'nemesis_frags', 'victim', 'victim_frags', 
+                 'rating'])
+
+
+def json_data(R, server, boards, breakdowns=()):
+    '''Compact JSON with the stats of the players in R and the server. 
+    Each player is a list of numbers in the order of JSON_COLUMNS. boards
+    are the leaderboards() of the players of R, given as their indexes.
+
+    breakdowns are the maps and game types, see write_html(), each with 
+    its games, time, players and leaderboards, given as ids.'''
+    players = [[player['name'], player['id']] + 
+               [player[column] for column in SUM_COLUMNS]
+               + player['ping'] + player['weapons'] + player['ctf'] + 
+               player['items'] + list(player['nemesis'] + player['victim']) +
+               [round(player['rating'], 1)] for player in R]
+    index = dict((id(player), i) for i, player in enumerate(R))
+    boards = OrderedDict((option, [index[id(player)] for player in board])
+                         for option, board in sorted(boards.items()))
+    # Keys in a fixed order, without sort_keys, which is much slower
+    data = OrderedDict([('server', OrderedDict([('hostname', server.hostname),
+                                                ('gametype', server.gtype),
+                                                ('frags', server.frags),
+                                                ('time', server.time)])),
+                        ('columns', JSON_COLUMNS), ('players', players),
+                        ('leaderboards', boards)])
+    for section, groups in breakdowns:
+        data[section] = OrderedDict(
+            (label, OrderedDict([('games', games), ('time', gtime), 
+                                 ('players', players), 
+                                 ('leaderboards', OrderedDict(
+                                     (option, [player['id'] for player in 
+                                               group_boards[option]])
+                                     for option in sorted(group_boards)))]))
+            for label, games, gtime, players, group_boards in groups)
+    return json.dumps(data, separators=(',', ':'), encoding='latin-1')
+
+
+def head_to_head(versus, players=None):
+    '''Nemesis, who fragged each player the most, and favourite victim, who
+    each player fragged the most, from versus: (killer, victim, frags) for
+    each pair of players, see read_versus(). Only players in players count,
+    if given.
+
+    Returns two dictionaries of (name, frags) keyed by player name. Pairs 
+    are gone through once, keeping only the best so far of each player, so
+    there is never a matrix of every player against every other. Ties go 
+    to the first name in alphabetical order.'''
+    nemeses = {}
+    victims = {}
+    for killer, victim, frags in versus:
+        if players is not None and (killer not in players or 
+                                    victim not in players):
+            continue
+        name, most = nemeses.get(victim, ('', 0))
+        if frags > most or (frags == most and killer < name):
+            nemeses[victim] = (killer, frags)
+        name, most = victims.get(killer, ('', 0))
+        if frags > most or (frags == most and victim < name):
+            victims[killer] = (victim, frags)
+    return nemeses, victims
+
+
 def apply_ban(R, BAN_LIST):
-    ''''Possibly naive implementation of a black list of players.'''
-    R_names = [player['name'] for player in R]
-    ban_list_index = []
-
-    for name in BAN_LIST:
-        if name in R_names:
-            ban_list_index.append(R_names.index(name))
-    for i in sorted(ban_list_index, reverse = True):
-        del(R[i])
-    return R
+    '''The players of R who aren't in BAN_LIST, by name or by nick, colour 
+    codes aside, see player_key(). Done before picking the top players, so
+    that banned ones don't take their places.'''
+    banned = set(player_key(nick) for nick in BAN_LIST)
+    return [player for player in R if player['id'] not in banned and 
+            plain_name(player['name']) not in banned]
 
 
 def name_colour(nick):
@@ -765,6 +2076,13 @@ def name_colour(nick):
     return nick
 
 
+def name_colour_closed(nick):
+    '''name_colour(), with the SPANs it opens closed, for names other than
+    the one that goes first in a table row'''
+    nick = name_colour(nick)
+    return nick + '</SPAN>' * nick.count('<SPAN')
+
+
 def is_number(s):
     '''Is 's' a number?'''
     try:
@@ -791,51 +2109,73 @@ def make_main_table(R):
 def make_weapons_table(R):
     '''List storing data for weapons table'''
     weapons_table = []
-    for i in xrange(len(R)):
-        weapons_table.append([R[i]['name']])
-        weapons_table[i].extend(R[i]['weapons'][0:3])      # SHOTG, GAUNT, MGUN
-        weapons_table[i].append(sum(R[i]['weapons'][3:5])) # GRENADE
-        weapons_table[i].append(sum(R[i]['weapons'][5:7])) # ROCKET
-        weapons_table[i].append(sum(R[i]['weapons'][7:9])) # PLASMA
-        weapons_table[i].extend(R[i]['weapons'][9:11])     # RAIL, LIGHTG
-        weapons_table[i].extend(R[i]['weapons'][14:])      # NAILG, CHAING
-        weapons_table[i].append(sum(R[i]['weapons'][11:13])) # BFG
-        weapons_table[i].extend(R[i]['weapons'][13:14])      # TELEFRAG
-        
-    for i in xrange(len(weapons_table)):
-        for j in xrange(1, len(weapons_table[i])):
-            value = (100. * weapons_table[i][j] / R[i]['frags'])
-            weapons_table[i][j] = str(round(value, 2))
+    for player in R:
+        w = player['weapons']
+        frags = player['frags']
+        weapons_table.append([player['name']] + [
+                100. * n / frags for n in
+                (w[0], w[1], w[2],              # SHOTG, GAUNT, MGUN
+                 w[3] + w[4],                   # GRENADE
+                 w[5] + w[6],                   # ROCKET
+                 w[7] + w[8],                   # PLASMA
+                 w[9], w[10],                   # RAIL, LIGHTG
+                 w[14], w[15],                  # NAILG, CHAING
+                 w[11] + w[12],                 # BFG
+                 w[13])])                       # TELEFRAG
     return weapons_table
 
 
 def make_stats_table(R):
     '''Another table with more numbers'''
     stats_table = []
-    for i in xrange(len(R)):
+    for player in R:
+        games, time = player['games'], player['time']
+        frags, deaths = player['frags'], player['deaths']
+        suics = player['suics'] + player['wfrags']
         # name        % games won  frags/deaths    frags/hour      frags/game
         # deaths/hour deaths/game  suic+fall/hour  suic+fall/game  efficiency
-        stats_table.append([
-                R[i]['name'], 100. * R[i]['won'] / R[i]['games'],
-                1.* R[i]['frags'] / (1 + R[i]['deaths']),
-                3600. * R[i]['frags']  / R[i]['time'],
-                1.* R[i]['frags'] / R[i]['games'],
-                3600.* R[i]['deaths'] / R[i]['time'],
-                1.* R[i]['deaths'] / R[i]['games'],
-                3600. * (R[i]['suics'] + R[i]['wfrags']) / R[i]['time'],
-                1. * (R[i]['suics'] + R[i]['wfrags']) / R[i]['games'],
-                100. * R[i]['frags'] / (1 + R[i]['frags'] + R[i]['deaths'])])
-
-    for i in xrange(len(stats_table)):
-        for j in xrange(1, len(stats_table[i])):
-            stats_table[i][j] = str(round(stats_table[i][j], 2))
+        # rating
+        stats_table.append([player['name'], 
+                            100. * player['won'] / games, 
+                            1. * frags / (1 + deaths),
+                            3600. * frags / time, 1. * frags / games,
+                            3600. * deaths / time, 1. * deaths / games,
+                            3600. * suics / time, 1. * suics / games,
+                            100. * frags / (1 + frags + deaths), 
+                            player['rating']])
     return stats_table
 
 
+def make_breakdown_table(groups):
+    '''Maps or game types: games, time, players per game and best players, 
+    see write_html()'''
+    breakdown_table = []
+    for label, games, gtime, players, boards in groups:
+        best = ', '.join(name_colour_closed(player['name']) 
+                         for player in boards[SORT_OPTION])
+        breakdown_table.append([label, games, str(timedelta(seconds=gtime)),
+                                round(1. * players / games, 1), best])
+    return breakdown_table
+
+
+def make_hosts_table(server):
+    '''Per host totals, when data comes from several servers'''
+    hosts_table = []
+    for hostname in sorted(server.hosts):
+        frags, time = server.hosts[hostname]
+        hosts_table.append([name_colour(hostname), 
+                            str(timedelta(seconds=time)), frags])
+    return hosts_table
+
+
 def make_quotes_table(quotes_list):
-    '''Random quotes'''
+    '''Random quotes. The same quotes are always picked from the same list,
+    so the report doesn't change when there is nothing new.'''
     quotes_table = []
     if len(quotes_list) > 0:
+        quotes_list = sorted(quotes_list)
+        seed = hashlib.sha1(repr(quotes_list)).hexdigest()
+        randint = Random(int(seed, 16)).randint
         for i in xrange(NUMBER_OF_QUOTES):
             a = quotes_list[int(randint(0,len(quotes_list)-1))]
             quotes_table.append([ name_colour(a[0]), a[1] ] )
@@ -852,49 +2192,140 @@ def make_ctf_table(R):
     return ctf_table
 
 
-def make_table(L,  style1_even, style1_odd, style2_even, style2_odd):
+def make_items_table(R):
+    '''Table with item pickups: armor, mega health and power-ups'''
+    items_table = []
+    for i in xrange(len(R)):
+        items_table.append( [ R[i]['name'] ] )
+        items_table[i].extend( R[i]['items'] )
+    return items_table
+
+
+def make_versus_table(R):
+    '''Table with the nemesis and favourite victim of each player'''
+    versus_table = []
+    names = {}          # The same few players are the nemesis of many
+    for player in R:
+        nemesis, nemesis_frags = player['nemesis']
+        victim, victim_frags = player['victim']
+        for name in (nemesis, victim):
+            if name not in names:
+                names[name] = name_colour_closed(name)
+        versus_table.append([player['name'], names[nemesis], nemesis_frags,
+                             names[victim], victim_frags])
+    return versus_table
+
+
+# How the cells of the tables with numbers worked out for the report are 
+# formatted, see make_table(). Those of the other tables are '%s'.
+TABLE_FORMATS = {'stats':   ('%s',) + ('%.2f',) * 9 + ('%.0f',),
+                 'weapons': ('%s',) + ('%.2f',) * 12}
+
+# Format strings of an even and an odd row, by formats and styles, so 
+# they are only put together once, see make_table()
+ROW_TEMPLATES = {}
+
+
+def row_template(formats, name_style, style):
+    """Format string of a table row with a cell per format in formats: the
+    player name, with class name_style, and the rest, with class style."""
+    return ('<TR>\n<TD><DIV class="%s">%s</SPAN>\n</DIV></TD>' % 
+            (name_style, formats[0]) + 
+            ''.join('<TD><DIV class="%s">%s\n</DIV></TD>\n' % (style, cell)
+                    for cell in formats[1:]) + '</TR>\n')
+
+
+def make_table(L,  style1_even, style1_odd, style2_even, style2_odd, 
+               formats=None):
     '''Generate HTML table from input data stored in list L.
        style1_even and style1_odd is the style class for the even and 
        odd entries of the first column (player names).
-       style2_even and style2_odd are the equivalent the other entries.'''
-    lines = []
-    
-    for i in xrange(len(L)):
-        if (mod(i,2) == 0):
-            str1 = '<TR>\n'
-            str1 = str1 + '<TD><DIV class="%s">' %style1_even + str(L[i][0]) +'</SPAN>\n'
-            str1 = str1 + '</DIV></TD>'
-            str2 = ''
-        else:
-            str1 = '<TR>\n'
-            str1 = str1 + '<TD><DIV class="%s">' %style1_odd + str(L[i][0]) +'</SPAN>\n'
-            str1 = str1 + '</DIV></TD>'
-            str2 = ''
-        for j in xrange(1,len(L[0])):
-            if (mod(i,2) == 0):
-                str2 =  str2 + '<TD><DIV class="%s">' %style2_even + str(L[i][j]) + '\n'
-                str2 = str2 + '</DIV></TD>\n'
-            else:
-                str2 =  str2 + '<TD><DIV class="%s">' %style2_odd + str(L[i][j]) + '\n'
-                str2 = str2 + '</DIV></TD>\n'
-        str2 = str2 + '</TR>\n'
-        lines.append(str1)
-        lines.append(str2)
-    lines.append('</TABLE>')
-    return lines
-
-
-def write_table(f, table_header, table_data, style1_even, style1_odd, 
-                style2_even, style2_odd, end_div=False):
-    '''Write HTML table to file from a 'header' (The first part of the table
-       up to the actual data) and the data stored in a list.'''
-    f.write(table_header)
-    lines = make_table(table_data, style1_even, style1_odd,
-                                    style2_even, style2_odd)
-    for line in lines:
-        f.write(line)
+       style2_even and style2_odd are the equivalent the other entries.
+       formats are the % formats of the cells of a row, '%s' if None, 
+       see TABLE_FORMATS.
+       
+       The rows are put together into a single format string, which is 
+       filled in with every value of L in one go.'''
+    if len(L) == 0:
+        return '</TABLE>'
+    if formats is None:
+        formats = ('%s',) * len(L[0])
+    layout = (formats, style1_even, style1_odd, style2_even, style2_odd)
+    if layout not in ROW_TEMPLATES:
+        ROW_TEMPLATES[layout] = (
+            row_template(formats, style1_even, style2_even) + 
+            row_template(formats, style1_odd, style2_odd))
+    pair = ROW_TEMPLATES[layout]
+    template = pair * (len(L) // 2) + pair[:len(pair) // 2] * (len(L) % 2)
+    return template % tuple(chain.from_iterable(L)) + '</TABLE>'
+
+
+def table_html(table_header, table_data, style1_even, style1_odd, 
+               style2_even, style2_odd, end_div=False, formats=None):
+    '''HTML table from a 'header' (The first part of the table up to the
+       actual data) and the data stored in a list, see make_table().'''
+    html = table_header + make_table(table_data, style1_even, style1_odd,
+                                     style2_even, style2_odd, formats)
     if end_div is True:
-        f.write('</DIV>')
+        html += '</DIV>'
+    return html
+
+
+def report_section(fragments, section, key, render):
+    '''HTML of a section of the report, from the fragment cache if it can.
+
+    fragments is a dictionary of section: (hash, html), or None for no 
+    cache. key() returns everything the section is made of, and render() 
+    puts the HTML together. It is only called if the hash of key() is not
+    the cached one.'''
+    if fragments is None:
+        return render()
+    digest = hashlib.sha1(marshal.dumps(key(), 2)).hexdigest()
+    if section in fragments and fragments[section][0] == digest:
+        return fragments[section][1]
+    html = render()
+    fragments[section] = (digest, html)
+    return html
+
+
+# Player stats that each table of the report is made of, see table_key()
+TABLE_FIELDS = {'main':    ['name', 'games', 'won', 'time', 'hand', 'ping', 
+                            'frags', 'deaths', 'suics', 'wfrags', 
+                            'excellent', 'impressive'],
+                'ctf':     ['name', 'ctf', 'defence', 'assist', 'capture'],
+                'items':   ['name', 'items'],
+                'stats':   ['name', 'won', 'games', 'frags', 'deaths', 
+                            'time', 'suics', 'wfrags', 'rating'],
+                'weapons': ['name', 'weapons', 'frags'],
+                'versus':  ['name', 'nemesis', 'victim']}
+
+
+def table_key(table_header, R, fields, formats=None):
+    '''What a table of player stats is made of, for report_section()'''
+    return (table_header, formats, map(itemgetter(*fields), R))
+
+
+def write_changed(path, data, fragments, section):
+    '''write_file(), unless data is what was written to path last time. Its
+    hash is kept in fragments, under section, see report_section().'''
+    digest = hashlib.sha1(data).hexdigest()
+    if fragments is not None:
+        if fragments.get(section, (None,))[0] == digest and \
+                os.path.exists(path):
+            return
+        fragments[section] = (digest, '')
+    write_file(path, data)
+
+
+def write_file(path, data):
+    '''Write data to path in a single write, atomically: whoever reads
+    path sees the old file or the new one, never half a file.'''
+    tmp_file = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_file, 'w') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)          # Windows won't rename over a file
+    os.rename(tmp_file, path)
 
 
 def open_browser(OPEN_BROWSER, html_file):
@@ -905,18 +2336,17 @@ def open_browser(OPEN_BROWSER, html_file):
         print '\nSorry, I could not open a browser for you\n'
 
 
-def move_html_output(html_file, MOVE_HTML_OUTPUT):
-    '''Move HTML file to expected directory'''
+def html_path(report):
+    '''Where the HTML output of report goes: next to the logs, or into
+    directory html_files if MOVE_HTML_OUTPUT is True'''
+    html_file = report + '.html'
     if MOVE_HTML_OUTPUT is True:
         script_dir = os.path.dirname(os.path.realpath(__file__))
-        html_file_name = os.path.split(html_file)[-1]
-        html_file_new = os.path.join(script_dir, 'html_files', html_file_name)
-        if os.path.exists(html_file_new):
-            os.remove(html_file_new)
-        shutil.copy(html_file, html_file_new)
-    else:
-        html_file_new = html_file
-    return html_file_new
+        html_dir = os.path.join(script_dir, 'html_files')
+        if not os.path.isdir(html_dir):
+            os.makedirs(html_dir)
+        html_file = os.path.join(html_dir, os.path.split(html_file)[-1])
+    return html_file
 
 
 # Raw strings needed to write HTML file
@@ -971,6 +2401,60 @@ html_header = r'''
 <DIV class="titulocuadro"></DIV>
 '''
 
+hosts_table_header = r'''
+
+<DIV class="centrartabla">
+<TABLE class="tablaserver" >
+
+<TR>
+<TH><DIV class="tituloup2">Server Name</DIV></TH>
+<TH><DIV class="tituloup2">Server Total Time</DIV></TH>
+<TH><DIV class="tituloup2">Total Frags</DIV></TH>
+</TR>
+'''
+
+maps_table_header = r'''
+
+<DIV class="centrartabla">
+<TABLE class="tablaserver" >
+
+<TR>
+<TH><DIV class="tituloup2">Map</DIV></TH>
+<TH><DIV class="tituloup2">Games</DIV></TH>
+<TH><DIV class="tituloup2">Time</DIV></TH>
+<TH><DIV class="tituloup2">Players per game</DIV></TH>
+<TH><DIV class="tituloup2">Best players</DIV></TH>
+</TR>
+'''
+
+gametypes_table_header = r'''
+
+<DIV class="centrartabla">
+<TABLE class="tablaserver" >
+
+<TR>
+<TH><DIV class="tituloup2">Game type</DIV></TH>
+<TH><DIV class="tituloup2">Games</DIV></TH>
+<TH><DIV class="tituloup2">Time</DIV></TH>
+<TH><DIV class="tituloup2">Players per game</DIV></TH>
+<TH><DIV class="tituloup2">Best players</DIV></TH>
+</TR>
+'''
+
+periods_table_header = r'''
+
+<DIV class="centrartabla">
+<TABLE class="tablaserver" >
+
+<TR>
+<TH><DIV class="tituloup2">Period</DIV></TH>
+<TH><DIV class="tituloup2">Games</DIV></TH>
+<TH><DIV class="tituloup2">Time</DIV></TH>
+<TH><DIV class="tituloup2">Players per game</DIV></TH>
+<TH><DIV class="tituloup2">Best players</DIV></TH>
+</TR>
+'''
+
 quotes_table_header = r'''
 
 <DIV class="centrartabla">
@@ -1058,6 +2542,7 @@ stats_table_header = r'''
 <TH><DIV class="tituloup">Suics+falling</DIV></TH>
 <TH><DIV class="tituloup">Suics+falling</DIV></TH>
 <TH><DIV class="tituloup">Efficiency</DIV></TH>
+<TH><DIV class="tituloup">Rating</DIV></TH>
 </TR>
 
 <TR>
@@ -1071,6 +2556,7 @@ stats_table_header = r'''
 <TH><DIV class="tituloup3">per hour</DIV></TH>
 <TH><DIV class="tituloup3">per game</DIV></TH>
 <TH><DIV class="tituloup3"></DIV></TH>
+<TH><DIV class="tituloup3">Elo</DIV></TH>
 </TR>
 '''
 
@@ -1112,87 +2598,563 @@ weapon_table_header = r'''
 '''
 
 items_table_header = r'''
+<DIV class="centrartabla2">
 <TABLE class="tabladatos">
 
 <TR>
-<TH><DIV class="tituloup"></Div></TD>
-<TH><DIV class="tituloup">Awards</DIV></TD>
+<TH><DIV class="tituloup"></DIV></TH>
+<TH><DIV class="tituloup">Combat</DIV></TH>
+<TH><DIV class="tituloup">Mega</DIV></TH>
+<TH><DIV class="tituloup">Quad</DIV></TH>
+<TH><DIV class="tituloup">Regeneration</DIV></TH>
+<TH><DIV class="tituloup">Haste</DIV></TH>
+</TR>
+
+<TR>
+<TD><DIV class="tituloup3"></DIV></TD>
+<TD><DIV class="tituloup3">armor</DIV></TD>
+<TD><DIV class="tituloup3">health</DIV></TD>
+<TD><DIV class="tituloup3">damage</DIV></TD>
+<TD><DIV class="tituloup3"></DIV></TD>
+<TD><DIV class="tituloup3"></DIV></TD>
+</TR>
 '''
 
-def main(log_file=None):
-    '''Main wrapper to get the job done'''
-    log_file = check_args(log_file)
-    cache = check_cache(log_file)
-    log, LINE_COUNT = read_log(log_file, cache)
-    server, cgames = mainProcessing(log)
-    quotes_list = get_quotes(cgames)
-
-    if len(cache) == 0:
-        # No cache present, compute player stats
-        if len(cgames) != 0:
-            R = player_stats_total(cgames)
-        else:
-            print '\nNo valid games found in log. Play a bit more.\n'
-            raise SystemExit()
-    else:
-        R, quotes_list, server = addFromCache(cgames, quotes_list, cache)
+versus_table_header = r'''
+<DIV class="centrartabla2">
+<TABLE class="tabladatos">
 
-    # write new cache file
-    writeCache(R, LINE_COUNT, server, quotes_list, log_file)
-    del R[-4:]                  # Once written delete extra bits not needed now
-    R = results_ordered(R, SORT_OPTION, MAXPLAYERS)
-    server = set_gametype(server)   # update server with correct gametype
+<TR>
+<TH><DIV class="tituloup"></DIV></TH>
+<TH><DIV class="tituloup">Nemesis</DIV></TH>
+<TH><DIV class="tituloup">Frags</DIV></TH>
+<TH><DIV class="tituloup">Favourite</DIV></TH>
+<TH><DIV class="tituloup">Frags</DIV></TH>
+</TR>
+
+<TR>
+<TD><DIV class="tituloup3"></DIV></TD>
+<TD><DIV class="tituloup3"></DIV></TD>
+<TD><DIV class="tituloup3">by nemesis</DIV></TD>
+<TD><DIV class="tituloup3">victim</DIV></TD>
+<TD><DIV class="tituloup3">on victim</DIV></TD>
+</TR>
+'''
+
+sort_script = r'''
+<SCRIPT type="text/javascript">
+// Tables of players can be sorted by any column, by clicking on its title
+// (click again to reverse), and filtered by name with the box on top. All
+// of it with the rows already in the page, no new data is needed.
+(function () {
+    function text(cell) {
+        return (cell.textContent || cell.innerText || '').replace(/^\s+|\s+$/g, '');
+    }
+
+    function value(s) {
+        var t = s.match(/^(?:(\d+) days?, )?(\d+):(\d\d):(\d\d)$/);  // Time
+        if (t) {
+            return ((Number(t[1] || 0) * 24 + Number(t[2])) * 60 + 
+                    Number(t[3])) * 60 + Number(t[4]);
+        }
+        var n = parseFloat(s);
+        return isNaN(n) ? s.toLowerCase() : n;
+    }
+
+    function div(cell) {
+        return cell.getElementsByTagName('DIV')[0];
+    }
+
+    function isPlayer(row) {
+        return row.cells.length > 0 && div(row.cells[0]) !== undefined &&
+               /^jugador/.test(div(row.cells[0]).className);
+    }
+
+    function styles(row) {
+        var classes = [], i;
+        for (i = 0; i < row.cells.length; i++) {
+            classes.push(div(row.cells[i]).className);
+        }
+        return classes;
+    }
+
+    // Make table sortable, returns its rows of players
+    function sortable(table) {
+        var rows = [], titles = null, i;
+        for (i = 0; i < table.rows.length; i++) {
+            if (isPlayer(table.rows[i])) {
+                rows.push(table.rows[i]);
+            } else if (titles === null) {
+                titles = table.rows[i];
+            }
+        }
+        if (rows.length === 0 || titles === null) {
+            return [];
+        }
+        // Styles of even and odd rows, which stay in place
+        var even = styles(rows[0]);
+        var odd = rows.length > 1 ? styles(rows[1]) : even;
+        var column = -1, descending = false;
+
+        function sortBy(c) {
+            var keyed = [], classes, i, j;
+            descending = (c === column) ? !descending : c > 0;  // Names A-Z
+            column = c;
+            for (i = 0; i < rows.length; i++) {
+                keyed.push([value(text(rows[i].cells[c])), i, rows[i]]);
+            }
+            keyed.sort(function (a, b) {
+                if (a[0] < b[0]) {
+                    return descending ? 1 : -1;
+                }
+                if (a[0] > b[0]) {
+                    return descending ? -1 : 1;
+                }
+                return a[1] - b[1];
+            });
+            for (i = 0; i < keyed.length; i++) {
+                rows[i] = keyed[i][2];
+                classes = (i % 2 === 0) ? even : odd;
+                for (j = 0; j < rows[i].cells.length; j++) {
+                    div(rows[i].cells[j]).className = classes[j];
+                }
+                rows[i].parentNode.appendChild(rows[i]);
+            }
+        }
+
+        for (i = 0; i < titles.cells.length; i++) {
+            titles.cells[i].style.cursor = 'pointer';
+            titles.cells[i].onclick = (function (c) {
+                return function () { sortBy(c); };
+            }(i));
+        }
+        return rows;
+    }
+
+    var tables = document.getElementsByTagName('TABLE');
+    var players = [], first = null, i;
+    for (i = 0; i < tables.length; i++) {
+        if (tables[i].className === 'tabladatos') {
+            players = players.concat(sortable(tables[i]));
+            first = first || tables[i];
+        }
+    }
+    if (first === null) {
+        return;
+    }
+    var find = document.createElement('DIV');
+    var box = document.createElement('INPUT');
+    find.className = 'find';
+    find.appendChild(document.createTextNode('Find player: '));
+    find.appendChild(box);
+    box.onkeyup = function () {
+        var wanted = box.value.toLowerCase(), i;
+        for (i = 0; i < players.length; i++) {
+            players[i].style.display = text(players[i].cells[0]).
+                toLowerCase().indexOf(wanted) === -1 ? 'none' : '';
+        }
+    };
+    first.parentNode.insertBefore(find, first);
+}());
+</SCRIPT>
+'''
+
+# Player stats that write_html() is given, see PlayerTotals.report()
+REPORT_FIELDS = SUM_COLUMNS + ['id', 'name', 'rating', 'ping', 'weapons', 
+                               'ctf', 'items']
+
+
+def report_inputs(R, server, quotes_list, breakdowns, versus):
+    '''Hash of everything write_html() puts the report together from: its
+    arguments, the options and the templates. When it is that of last 
+    time, so are the HTML and JSON files, and nothing needs to be worked
+    out for them.'''
+    fields = itemgetter(*REPORT_FIELDS)
+    groups = [(section, [(label, games, gtime, players, map(fields, group)) 
+                         for label, games, gtime, players, group in groups])
+              for section, groups in breakdowns]
+    server = (getattr(server, 'hostname', ''), server.gtype, server.frags,
+              server.time, sorted(getattr(server, 'hosts', {}).items()))
+    options = (STORE_VERSION, MAXPLAYERS, SORT_OPTION, LEADERBOARDS, 
+               BREAKDOWN_PLAYERS, BAN_LIST, NUMBER_OF_QUOTES, JSON_DATA, 
+               GTYPE_OVERRIDE, DISPLAY_CTF_TABLE, DISPLAY_ITEMS_TABLE, 
+               DISPLAY_VERSUS_TABLE, MOVE_HTML_OUTPUT)
+    templates = (html_header, sort_script, hosts_table_header, 
+                 maps_table_header, gametypes_table_header, 
+                 periods_table_header, quotes_table_header, 
+                 main_table_header, ctf_table_header, stats_table_header,
+                 weapon_table_header, items_table_header, versus_table_header)
+    key = (options, templates, REPORT_FIELDS, map(fields, R), server, 
+           sorted(quotes_list), groups, list(versus))
+    return hashlib.sha1(marshal.dumps(key, 2)).hexdigest()
+
+
+def write_html(R, server, quotes_list, report, fragments=None, 
+               breakdowns=(), versus=()):
+    '''Sort, filter and write player data to the HTML file.
+
+    report is the path of the output without extension, see report_base().
+    R and server are left untouched. Returns the path of the HTML file.
+
+    breakdowns are ('maps', groups), ('gametypes', groups) and ('periods',
+    groups), each group being (label, games, time, players, R) of a map, 
+    game type or number of days, see PERIODS, with the players that were 
+    in them and R the players' stats in those games. versus is who fragged
+    whom, see head_to_head().
+
+    fragments is a cache of the sections of the page, see report_section(),
+    updated here. With it, the file isn't written at all if it would be
+    the same as last time, and if what it is made of is the same, see 
+    report_inputs(), it isn't even put together.'''
+    html_file = html_path(report)
+    json_file = os.path.splitext(html_file)[0] + '.json'
+    inputs = None
+    if fragments is not None and DUMP_DATA not in ('yes', 'Yes', 'YES'):
+        inputs = report_inputs(R, server, quotes_list, breakdowns, versus)
+        if fragments.get('inputs', (None,))[0] == inputs and \
+                os.path.exists(html_file) and \
+                (JSON_DATA is not True or os.path.exists(json_file)):
+            return html_file
+    # Take rid of players with autodownload 'off' who appear to join the 
+    # server momentarily. Done here rather than when adding up the games,
+    # so that the totals are the same however the games are added up.
+    R = [player for player in R if player['frags'] != 0]
+    R = apply_ban(R, BAN_LIST)
+    nicks = dict((player['id'], player['name']) for player in R)
+    nemeses, victims = head_to_head(versus, nicks)
+    R = [dict(player, nemesis=nemeses.get(player['id'], ('', 0)), 
+              victim=victims.get(player['id'], ('', 0))) for player in R]
+    for player in R:
+        for column in ('nemesis', 'victim'):
+            name, frags = player[column]
+            player[column] = (nicks.get(name, name), frags)
+    server = set_gametype(copy.copy(server)) # update with correct gametype
+    # Every ranking in one go over the players
+    options = [SORT_OPTION] + LEADERBOARDS
+    boards = leaderboards(R, options, MAXPLAYERS)
+    # Same for the players of each map and game type
+    ranked = []
+    for section, groups in breakdowns:
+        if BREAKDOWN_PLAYERS <= 0:
+            break
+        ranked.append((section, []))
+        for label, games, gtime, players, group in groups:
+            group = [player for player in group if player['frags'] != 0]
+            group = apply_ban(group, BAN_LIST)
+            ranked[-1][1].append((label, games, gtime, players, leaderboards(
+                                     group, options, BREAKDOWN_PLAYERS)))
+    breakdowns = ranked
+    if JSON_DATA is True:
+        # Every player, for whoever wants to rank them some other way
+        write_changed(json_file, json_data(R, server, boards, breakdowns),
+                      fragments, 'json')
+    R = [dict(player) for player in boards[SORT_OPTION]] # Names coloured below
 
     # Dump data in JSON format if so required. Do this now, once data is sorted
     # but before parsing the colour codes: they aren't useful without the .css
     if DUMP_DATA in ('yes', 'Yes', 'YES'):
-        dumpJsonfile(R)
+        dumpJsonfile(R, report)
     
-    R = apply_ban(R, BAN_LIST)
     for player in R:
         player['name'] = name_colour(player['name'])
 
-    # Put together data tables
-    main_table_data = make_main_table(R)
-    weapons_table = make_weapons_table(R)
-    stats_table = make_stats_table(R)
-    quotes_table = make_quotes_table(quotes_list)
-    ctf_table = make_ctf_table(R)
-
-    html_file = str(log_file)[:-3] + 'html'
-    f = open(html_file, 'w')
-    f.write(html_header %(datetime.now().strftime("%c"),
-                            name_colour(server.hostname),
-                            str(timedelta(seconds=server.time)), 
-                            server.gtype, server.frags))
-
-    if (NUMBER_OF_QUOTES != 0) and (len(quotes_list) != 0):
-        write_table(f, quotes_table_header, quotes_table, 'jugadorquotes',
-                    'jugadorquotes', 'datoquotes', 'datoquotes', end_div=True)
-        
-    write_table(f, main_table_header, main_table_data, 'jugador',
-                'jugador2', 'dato', 'dato2', end_div=False)
+    hosts = getattr(server, 'hosts', {})
+    if len(hosts) > 1:
+        hostname = str(len(hosts)) + ' servers'
+    else:
+        hostname = name_colour(server.hostname)
+    header = (hostname, str(timedelta(seconds=server.time)), server.gtype, 
+              server.frags)
 
     if len(R) == 0:
         # This situation may happen when attempting to analyse very small
         # logs with a restrictive ban list.
         print '\nNo player data. Play some more?\n'
-        pass
+
+    # Sections of the page: name, what it is made of and how to put it 
+    # together. Only those which changed are put together, see 
+    # report_section(), and their data tables are only made then.
+    def player_table(section, table_header, make, styles, end_div=True):
+        formats = TABLE_FORMATS.get(section)
+        return (section, 
+                lambda: table_key(table_header, R, TABLE_FIELDS[section],
+                                  formats),
+                lambda: table_html(table_header, make(R), *styles, 
+                                   end_div=end_div, formats=formats))
+
+    def breakdown_table(section, table_header, groups):
+        rows = make_breakdown_table(groups)
+        return (section, lambda: (table_header, rows),
+                lambda: table_html(table_header, rows, 'server', 'server', 
+                                   'datoserver', 'datoserver', end_div=True))
+
+    sections = []
+    if len(hosts) > 1:
+        sections.append(('hosts', lambda: sorted(hosts.items()), 
+                         lambda: table_html(hosts_table_header, 
+                                            make_hosts_table(server), 
+                                            'server', 'server', 'datoserver',
+                                            'datoserver', end_div=True)))
+    if (NUMBER_OF_QUOTES != 0) and (len(quotes_list) != 0):
+        sections.append(('quotes', 
+                         lambda: (NUMBER_OF_QUOTES, sorted(quotes_list)),
+                         lambda: table_html(quotes_table_header, 
+                                            make_quotes_table(quotes_list),
+                                            'jugadorquotes', 'jugadorquotes',
+                                            'datoquotes', 'datoquotes', 
+                                            end_div=True)))
+    styles = ('jugador', 'jugador2', 'dato', 'dato2')
+    sections.append(player_table('main', main_table_header, make_main_table,
+                                 styles, end_div=False))
     if DISPLAY_CTF_TABLE is True:
         if any((n['ctf'] != [0, 0, 0]) for n in R):
-            write_table(f, ctf_table_header, ctf_table, 'jugador', 
-                        'jugador2', 'dato', 'dato2', end_div=True)
-
-    write_table(f, stats_table_header, stats_table, 'jugador', 
-                'jugador2', 'dato', 'dato2', end_div=True)
-    write_table(f, weapon_table_header, weapons_table, 'jugador2', 
-                'jugador', 'dato2', 'dato', end_div=True)
-    f.write('</DIV>\n<DIV class="endnote">Powered by pyqscore!</DIV>')
-    f.write('</DIV>\n</BODY>\n</HTML>')
-    f.close()
-    
-    html_file_new = move_html_output(html_file, MOVE_HTML_OUTPUT)
-    open_browser(OPEN_BROWSER, html_file_new)
+            sections.append(player_table('ctf', ctf_table_header, 
+                                         make_ctf_table, styles))
+    if DISPLAY_ITEMS_TABLE is True:
+        if any(sum(n['items']) != 0 for n in R):
+            sections.append(player_table('items', items_table_header, 
+                                         make_items_table, styles))
+    sections.append(player_table('stats', stats_table_header, 
+                                 make_stats_table, styles))
+    sections.append(player_table('weapons', weapon_table_header, 
+                                 make_weapons_table, 
+                                 ('jugador2', 'jugador', 'dato2', 'dato')))
+    if DISPLAY_VERSUS_TABLE is True:
+        if any(n['nemesis'][1] + n['victim'][1] != 0 for n in R):
+            sections.append(player_table('versus', versus_table_header, 
+                                         make_versus_table, styles))
+    headers = {'maps': maps_table_header, 'gametypes': gametypes_table_header,
+               'periods': periods_table_header}
+    for section, groups in breakdowns:
+        # A single map or game type is all in the tables above
+        if len(groups) > 1 or (section == 'periods' and len(groups) > 0):
+            sections.append(breakdown_table(section, headers[section], 
+                                            groups))
+
+    body = [report_section(fragments, section, key, render) 
+            for section, key, render in sections]
+    if inputs is not None:
+        fragments['inputs'] = (inputs, '')
+    if fragments is not None:
+        # The templates are in too, in case pyqscore itself changed
+        digests = [section + fragments[section][0] 
+                   for section, key, render in sections]
+        digest = hashlib.sha1(' '.join([html_header, sort_script, 
+                                        repr(header)] + digests)).hexdigest()
+        if fragments.get('page', (None,))[0] == digest and \
+                os.path.exists(html_file):
+            # Same page as last time: leave the file, and its date, alone
+            return html_file
+
+    # The page is put together in memory and written in one go
+    page = [html_header % ((datetime.now().strftime("%c"),) + header)]
+    page.extend(body)
+    page.append('</DIV>\n<DIV class="endnote">Powered by pyqscore!</DIV>')
+    page.append('</DIV>\n' + sort_script + '</BODY>\n</HTML>')
+    write_file(html_file, ''.join(page))
+    if fragments is not None:
+        fragments['page'] = (digest, '')
+    return html_file
+
+
+def write_report(db, log_files, report=None, data=None):
+    '''Write the HTML output for some logs from the stats store. report 
+    is where, see report_base(), by default that of log_files. data is 
+    what it is written from, see ReportData, read from the store if not
+    given.
+
+    Returns the path of the HTML file, or None if there is no player data.'''
+    if report is None:
+        report = report_base(log_files)
+    if data is None:
+        data = ReportData(db, log_files, report)
+    if len(data.players) == 0:
+        return None
+    nicks = data.nicks
+    ratings = data.ratings
+    fragments = data.fragments
+    cached = dict(fragments)
+    breakdowns = []
+    for section, column in (('maps', 'mapname'), ('gametypes', 'gametype')):
+        groups = []
+        for value, games, gtime, nplayers, totals in data.breakdown(column):
+            if column == 'gametype':
+                value = gametype_name(value)
+            groups.append((value, games, gtime, nplayers, 
+                           player_list(totals, nicks, ratings)))
+        breakdowns.append((section, groups))
+    groups = []
+    for days, games, gtime, nplayers, totals in data.breakdown('periods'):
+        label = 'Today' if days == 1 else 'Last %d days' % days
+        groups.append((label, games, gtime, nplayers, 
+                       player_list(totals, nicks, ratings)))
+    breakdowns.append(('periods', groups))
+    versus = [pair + (frags,) for pair, frags in data.versus.iteritems()]
+    html_file = write_html(player_list(data.players, nicks, ratings), 
+                           combine_servers(data.servers),
+                           data.quotes, report, fragments, breakdowns, versus)
+    with db:
+        db.executemany('INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)',
+                       [(report, section) + fragment for section, fragment 
+                        in fragments.iteritems() 
+                        if cached.get(section) != fragment])
+    return html_file
+
+
+def follow(log_file, args=None):
+    '''Follow the log forever, folding in each game as soon as it ends.
+
+    The new games are kept in memory and added to the stats store, then the 
+    HTML file rewritten, at most FOLLOW_DELAY seconds after a game ends.
+    The store is only read for the first update: the new games are then
+    added to what the output is written from, see ReportData.
+    args are the arguments the log was given as, see report_base().'''
+    args = args or [log_file]
+    report = report_base(args)
+    db = open_store(store_path(args))
+    offset  = check_store(db, log_file) or 0
+    server  = Server()
+    players = {}                # Totals of the games not stored yet
+    quotes  = set()
+    games   = []
+    # Frags are only stored up to the checkpoint, the rest will be read 
+    # again if we are stopped in the middle of a game
+    state = {'pending': False, 'last': 0, 'offset': offset, 'frags': 0,
+             'data': None}
+
+    def flush(force=False):
+        if not state['pending']:
+            return
+        if force or time.time() - state['last'] >= FOLLOW_DELAY:
+            stored = copy.copy(server)
+            stored.frags = state['frags']
+            day = write_store(db, log_file, stored, players, quotes, games, 
+                              state['offset'])
+            if state['data'] is None:
+                state['data'] = ReportData(db, [log_file], report)
+            else:
+                state['data'].add_games(db, stored, players, quotes, games, 
+                                        day)
+            server.frags -= state['frags']        # Already stored
+            server.time = 0
+            state['frags'] = 0
+            players.clear()
+            quotes.clear()
+            del games[:]
+            write_report(db, [log_file], report, state['data'])
+            state['pending'] = False
+            state['last'] = time.time()
+            print datetime.now().strftime("%c") + ': stats updated.'
+
+    def rotate():
+        # The games of the old log are stored now, as resuming from 0 in 
+        # the new one. What is left of the old log won't be read again, so
+        # its frags are stored too.
+        state['offset'] = 0
+        state['frags'] = server.frags
+        state['pending'] = True
+        flush(force=True)
+
+    log = LogFollower(log_file, offset, on_tick=flush, on_rotate=rotate)
+    print '\nFollowing ' + log_file + '. Press Ctrl+C to stop.\n'
+    # Stop cleanly when killed, e.g. by an init script
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for game in iter_games(log, server):
+            record = game_record(game)
+            add_record(players, record)
+            quotes.update(game.quotes)
+            games.append(record)
+            # The game is complete, so it is safe to resume from here
+            state['offset'] = log.checkpoint
+            state['frags'] = server.frags
+            state['pending'] = True
+            flush()
+    except(KeyboardInterrupt, SystemExit):
+        flush(force=True)
+
+
+def process_log(log_file, offset, parallel=True):
+    '''Parse the games of one log from offset on.
+
+    Returns the server data, player totals, quotes and records of the new
+    games, in a GameSpool to be closed by the caller, and the offset to 
+    resume from next time. Big logs are parsed in parallel if parallel is
+    True and PROCESSES allows.'''
+    if (parallel is True and PROCESSES != 1 and 
+        not is_compressed(log_file) and
+        os.path.getsize(log_file) - offset > PARALLEL_MIN):
+        server, players, quotes, games, offset, count = parallelProcessing(
+                                log_file, offset, PROCESSES or None)
+    else:
+        log = LogReader(log_file, offset)
+        games = GameSpool()
+        server, players, quotes = mainProcessing(log, games)
+        offset, count = log.checkpoint, log.count
+    print  '\n' + str(count) + ' new lines read from ' + log_file + '.\n'
+    if is_compressed(log_file):
+        offset = os.path.getsize(log_file)
+    return server, players, quotes, games, offset
+
+
+def process_log_job(job):
+    '''process_log() for the worker processes of process_logs()'''
+    log_file, offset = job
+    return process_log(log_file, offset, parallel=False)
+
+
+def process_logs(db, log_files):
+    '''Bring the stats store up to date with the new games of every log.
+
+    Logs are parsed several at once if PROCESSES allows, but only this 
+    process writes to the store. They are stored oldest first, by the time
+    they were last written, so games are rated in the order they were
+    played: games.log.2, games.log.1 and then games.log.'''
+    log_files = sorted(log_files, key=os.path.getmtime)
+    follow_renames(db, log_files)
+    jobs = []
+    for log_file in log_files:
+        print '\nProcessing ' + log_file
+        offset = check_store(db, log_file)
+        if offset is not None:
+            jobs.append((log_file, offset))
+    if len(jobs) > 1 and PROCESSES != 1:
+        processes = min(PROCESSES or multiprocessing.cpu_count(), len(jobs))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(process_log_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        # One log at a time, each stored as soon as it is parsed
+        results = (process_log(log_file, offset) for log_file, offset in jobs)
+    for (log_file, offset), result in izip(jobs, results):
+        try:
+            write_store(db, log_file, *result)
+        finally:
+            result[3].close()                   # The GameSpool of its games
+
+
+def main(log_files=None):
+    '''Main wrapper to get the job done'''
+    args, log_files = check_args(log_files)
+    if FOLLOW is True:
+        if len(log_files) > 1:
+            print '\nOnly one log file can be followed. Exiting...\n'
+            raise SystemExit
+        follow(log_files[0], args)
+        return
+
+    # Output and store are named after the arguments, so they stay put 
+    # whatever files the globs match
+    db = open_store(store_path(args))
+    process_logs(db, log_files)
+    html_file = write_report(db, log_files, report_base(args))
+    if html_file is None:
+        print '\nNo valid games found in log. Play a bit more.\n'
+        raise SystemExit()
+    open_browser(OPEN_BROWSER, html_file)
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
@@ -1203,6 +3165,3 @@ if __name__ == '__main__':
         main(logfile)
     else:
         main()
-
-
-